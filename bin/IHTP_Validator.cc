@@ -5,12 +5,16 @@
 // 1. Download the JSON library at https://github.com/nlohmann/json/blob/develop/single_include/nlohmann/json.hpp
 // 2. Compile with a C++ compiler, for example with the GNU Compiler: g++ -o IHTP_Validator IHTP_Validator.cc 
 // 3. Run with: ./IHTP_Validator <instance_file> <solution_file> [verbose] 
+//    or as a server with: ./IHTP_Validator <instance_file> --server
+//    The server loads the instance once, then reads one solution per line (compact JSON) from the standard input
+//    and answers each one with the usual report followed by a line "END" (errors are reported as "ERROR <message>")
 
 #include <iostream>
 #include <iomanip>
 #include <fstream>
 #include <sstream>
 #include <vector>
+#include <algorithm>
 #include <string>
 #include <stdexcept>
 #include "json.hpp"
@@ -177,8 +181,10 @@ class IHTP_Input
 class IHTP_Output
 {
  public:
+  IHTP_Output(const IHTP_Input& my_in, bool verbose);
   IHTP_Output(const IHTP_Input& my_in, string file_name, bool verbose);
   void ReadJSON(string file_name);
+  void ReadJSON(const nlohmann::json& j_sol);
   void AssignPatient(int p, int d, int r, int t);
   void AssignNurse(int n, int r, int s);
   void UpdatewithOccupantsInfo();
@@ -481,6 +487,12 @@ int IHTP_Input::FindNurse(string nurse_id) const
 }
 
 IHTP_Output::IHTP_Output(const IHTP_Input& my_in, string file_name, bool verbose)
+  : IHTP_Output(my_in, verbose)
+{
+  ReadJSON(file_name);
+}
+
+IHTP_Output::IHTP_Output(const IHTP_Input& my_in, bool verbose)
   : in(my_in), VERBOSE(verbose), admission_day(in.Patients(),-1), room(in.Patients(),-1), 
    operating_room(in.Patients(),-1),
    patient_shift_nurse(in.Patients()+in.Occupants()),
@@ -500,21 +512,25 @@ IHTP_Output::IHTP_Output(const IHTP_Input& my_in, string file_name, bool verbose
       patient_shift_nurse[p].resize(in.PatientLengthOfStay(p)*in.ShiftsPerDay(),-1);
     else
       patient_shift_nurse[p].resize(in.OccupantLengthOfStay(p-in.Patients())*in.ShiftsPerDay(),-1);
-
-  ReadJSON(file_name);
 }
 
 void IHTP_Output::ReadJSON(string file_name)
 {
-	nlohmann::json j_sol, j_p, j_n;
-	unsigned i, j, p, n, cn;
-	int d, s, r, t;
-	string patient_id, nurse_id, room_id, ot_id, shift_name;
+	nlohmann::json j_sol;
 	ifstream is(file_name);
 
 	if(!is)
     throw invalid_argument("Cannot open solution file " + file_name);
   is >> j_sol;
+  ReadJSON(j_sol);
+}
+
+void IHTP_Output::ReadJSON(const nlohmann::json& j_sol)
+{
+	nlohmann::json j_p, j_n;
+	unsigned i, j, p, n, cn;
+	int d, s, r, t;
+	string patient_id, nurse_id, room_id, ot_id, shift_name;
 	Reset();
 	for (i = 0; i < j_sol["patients"].size(); i++)
 	{
@@ -600,15 +616,9 @@ void IHTP_Output::Reset()
          for (t = 0; t < in.OperatingTheaters(); t++)
            surgeon_day_theater_count[s][d][t] = 0;
        }
+    // Every shift of the stay (LengthOfStay*ShiftsPerDay entries), not only the first LengthOfStay
     for (p = 0; p < in.Patients()+in.Occupants(); p++)
-      if(p<in.Patients()){
-       for(s=0;s<in.PatientLengthOfStay(p);s++)
-        patient_shift_nurse[p][s]=-1;
-      }
-      else{
-        for(s=0;s<in.OccupantLengthOfStay(p-in.Patients());s++)
-          patient_shift_nurse[p][s]=-1;
-      }
+      fill(patient_shift_nurse[p].begin(), patient_shift_nurse[p].end(), -1);
   UpdatewithOccupantsInfo();
 }
 
@@ -907,6 +917,8 @@ int IHTP_Output::RoomSkillLevel() const
     {
       d = s / in.ShiftsPerDay();
       n = room_shift_nurse[r][s]; // nurse assigned to the room in that shift
+      if (n == -1) // uncovered room: counted by UncoveredRoom, there is no skill level to compare with
+        continue;
       for (i = 0; i < room_day_patient_list[r][d].size(); i++)
       {
         p = room_day_patient_list[r][d][i];
@@ -1138,17 +1150,46 @@ void IHTP_Output::PrintCosts() const
   cout << "Total cost = " << total_cost << endl;
 }
 
+void RunServer(const IHTP_Input& in)
+{ // scores one solution per line of the standard input until it is closed
+  string line;
+  IHTP_Output out(in, false);
+  while (getline(cin, line))
+  {
+    if (line.empty())
+      continue;
+    try
+    {
+      out.ReadJSON(nlohmann::json::parse(line));
+      out.PrintCosts();
+    }
+    catch (exception& e)
+    {
+      cout << "ERROR " << e.what() << endl;
+    }
+    cout << "END" << endl;
+  }
+}
+
 int main(int argc, const char *argv[])
 {
   if (argc != 3 && argc != 4)
   {
     cerr << "Usage: " << argv[0] << " <instance_file> <solution_file> [verbose]" << endl;
+    cerr << "   or: " << argv[0] << " <instance_file> --server" << endl;
     exit(1);
   }
   string instance_file_name = argv[1];
   string solution_file_name = argv[2];
   bool verbose = (argc == 4); // any word passed as fourth argument is interpreted as "verbose"
 
+  if (solution_file_name == "--server")
+  {
+    IHTP_Input in(instance_file_name);
+    RunServer(in);
+    return 0;
+  }
+
   IHTP_Input in(instance_file_name);
   IHTP_Output out(in, solution_file_name, verbose); 
   out.PrintCosts();
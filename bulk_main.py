@@ -1,7 +1,17 @@
 import os
+import sys
 import subprocess
 import argparse
 import json
+import hashlib
+import pandas as pd
+import time
+import random as rd
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from src.optimise.optimiser import Optimiser
+from src.utils.system import available_cores
+from src.utils.parity import instance_parity
 
 """
 Under competition settings:
@@ -11,62 +21,138 @@ Under competition settings:
 - Can vary pool size
 - Can vary time tolerance to ensure in limit
 
-Should take a maximum of 400 minutes (7 hours) to re-run all instances.
+Should take a maximum of 400 minutes (7 hours) to re-run all instances on 4 cores.
+Runs are packed onto the available cores, so a machine with 4N cores takes about 1/N of that.
 """
 
 # Parameters
 data_folder = "data/instances"
 solutions_folder = "data/solutions"
+logs_folder = "data/logs"
+check_cache_file = "data/check_cache.json"
+check_summary_file = "data/check_summary.csv"
+validator = "./bin/IHTP_Validator"
 time_taken = 600
 time_tolerance = 60
+cores_per_run = 4
+parity_moves = 200
+scaling_time = 20
 
 # Arguments
 parser = argparse.ArgumentParser()
 parser.add_argument('--check',action='store_true')
 parser.add_argument('--run',action='store_true')
+parser.add_argument('--parity',action='store_true')
+parser.add_argument('--scaling',action='store_true')
 args = parser.parse_args()
 
 
 # Bulk checking
 def bulk_check():
+    """
+    Checks every solution with the validator and writes a summary to check_summary_file.
+    Solutions are validated concurrently and results are cached by the content of the instance, solution and validator,
+    so only new or changed solutions are validated again.
+    """
     solutions = sorted([
         f for f in os.listdir(solutions_folder)
         if os.path.isfile(os.path.join(solutions_folder, f))
         ])
-    print(solutions)
+    solutions = [s for s in solutions if "test_" not in s]
+    results = check_solutions(solutions)
     for s in solutions:
-        if("test_" in s):
-            continue
-        d = s[4:]
-        data = '{}/{}'.format(data_folder,d)
-        sol_file = '{}/{}'.format(solutions_folder,s)
-        result = subprocess.run(
-            ['./bin/IHTP_Validator', data, sol_file],
-            capture_output = True, # Python >= 3.7 only
-            text = True # Python >= 3.7 only
-            )
-        violations = 0
-        cost = 0
-        reasons = []
-        for line in result.stdout.splitlines():
-                if("." in line and len(line.split()) == 1):
-                    if(int(line.split(".")[-1]) != 0):
-                        reasons.append(line.split(".")[0])
-                # Get violations
-                if("Total violations" in line):
-                    violations = int(line.split()[-1])
-                # Get cost
-                if("Total cost" in line):
-                    cost = int(line.split()[-1])
-        print(f"INSTANCE {d}: Violations = {violations}, Cost = {cost}")
+        print_check(s, results[s])
+    summary = pd.DataFrame([{"instance": s[4:],
+                             "violations": results[s]["violations"],
+                             "cost": results[s]["cost"],
+                             "reasons": ";".join(results[s]["reasons"])} for s in solutions])
+    summary.to_csv(check_summary_file, index=False)
+    print(f"Summary written to {check_summary_file}")
 
 
-# Bulk running
-def bulk_run():
-    data = sorted(os.listdir(data_folder))
-    for d in data:
-        print(f"Optimising instance {d}")
-        subprocess.run(
+# Check solution files, validating the ones not in the cache concurrently
+def check_solutions(solutions):
+    cache = {}
+    if(os.path.isfile(check_cache_file)):
+        # An unreadable cache (e.g. from an older, interrupted write) is rebuilt
+        try:
+            with open(check_cache_file, 'r') as file:
+                cache = json.load(file)
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            cache = {}
+    keys = {s: check_key(s) for s in solutions}
+    to_validate = [s for s in solutions if keys[s] not in cache]
+    if(len(to_validate) > 0):
+        with ThreadPoolExecutor(available_cores()) as executor:
+            for s, result in zip(to_validate, executor.map(validate_solution, to_validate)):
+                cache[keys[s]] = result
+        # Written to a temporary file then moved into place, so an interrupted run never leaves a truncated cache
+        with open(check_cache_file + ".tmp", 'w') as file:
+            json.dump(cache, file)
+        os.replace(check_cache_file + ".tmp", check_cache_file)
+    return {s: cache[keys[s]] for s in solutions}
+
+
+# Cache key of a solution: hash of the instance, the solution and the validator binary
+def check_key(s):
+    key = hashlib.sha256()
+    for f in ['{}/{}'.format(data_folder,s[4:]), '{}/{}'.format(solutions_folder,s)]:
+        with open(f, 'rb') as file:
+            key.update(file.read())
+    validator_stat = os.stat(validator)
+    key.update("{} {}".format(validator_stat.st_size, validator_stat.st_mtime_ns).encode())
+    return key.hexdigest()
+
+
+# Check a single solution file with the validator
+def validate_solution(s):
+    d = s[4:]
+    data = '{}/{}'.format(data_folder,d)
+    sol_file = '{}/{}'.format(solutions_folder,s)
+    result = subprocess.run(
+        [validator, data, sol_file],
+        capture_output = True, # Python >= 3.7 only
+        text = True # Python >= 3.7 only
+        )
+    violations = 0
+    cost = 0
+    reasons = []
+    for line in result.stdout.splitlines():
+            if("." in line and len(line.split()) == 1):
+                if(int(line.split(".")[-1]) != 0):
+                    reasons.append(line.split(".")[0])
+            # Get violations
+            if("Total violations" in line):
+                violations = int(line.split()[-1])
+            # Get cost
+            if("Total cost" in line):
+                cost = int(line.split()[-1])
+    return {"violations": violations, "cost": cost, "reasons": reasons}
+
+
+def print_check(s, result):
+    print(f"INSTANCE {s[4:]}: Violations = {result['violations']}, Cost = {result['cost']}")
+
+
+# Solution file of an instance
+def solution_name(d):
+    return "sol_{}".format(d)
+
+
+# Whether an instance already has a complete solution (an interrupted run may leave a partial file)
+def solution_exists(d):
+    try:
+        with open('{}/{}'.format(solutions_folder,solution_name(d)), 'r') as file:
+            json.load(file)
+        return True
+    except (OSError, ValueError):
+        return False
+
+
+# Optimise a single instance, the output of main.py goes to its log file
+def run_instance(d):
+    with open('{}/{}.log'.format(logs_folder,d[:-5]), 'w') as log:
+        result = subprocess.run(
                 ['python', 'main.py', 
                  str(d),
                  '--input_folder', data_folder, 
@@ -75,19 +161,103 @@ def bulk_run():
                 '--time_tolerance', '{}'.format(time_tolerance),
                 '--selection', 'none',
                 '--acceptance', 'none',
-                '--save_costs']
+                '--cores', '{}'.format(cores_per_run),
+                '--save_costs'],
+                stdout = log,
+                stderr = subprocess.STDOUT
                 )
-        print()
+    return result.returncode
+
+
+# Bulk running
+def bulk_run():
+    """
+    Runs the instances in parallel, each run using cores_per_run cores and as many runs at a time as the CPUs allow.
+    Instances which already have a solution are skipped, so an interrupted bulk run carries on where it stopped.
+    Each solution is checked with the validator as soon as its run finishes (while the other runs continue).
+    """
+    instances = sorted(os.listdir(data_folder))
+    to_run = [d for d in instances if not solution_exists(d)]
+    parallel_runs = max(1, available_cores()//cores_per_run)
+    os.makedirs(logs_folder, exist_ok=True)
+    print(f"Optimising {len(to_run)} instances ({len(instances)-len(to_run)} already solved), {parallel_runs} at a time")
+    print()
+    time_start = time.time()
+    with ThreadPoolExecutor(parallel_runs) as executor:
+        runs = {executor.submit(run_instance, d): d for d in to_run}
+        for finished, run in enumerate(as_completed(runs), 1):
+            d = runs[run]
+            print(f"[{finished}/{len(to_run)}, {time.time()-time_start:.0f}s] Finished instance {d}")
+            if(run.result() == 0 and solution_exists(d)):
+                print_check(solution_name(d), check_solutions([solution_name(d)])[solution_name(d)])
+            else:
+                print(f"INSTANCE {d}: Run failed, see {logs_folder}/{d[:-5]}.log")
     print()
     bulk_check()
 
 
+# Parity between the python evaluator and the validator (see src/utils/parity.py)
+def bulk_parity():
+    """
+    Checks the python evaluator against the validator on every instance, exits with status 1 if any solution differs.
+    """
+    instances = sorted(os.listdir(data_folder))
+    failures = 0
+    for d in instances:
+        mismatches = instance_parity('{}/{}'.format(data_folder,d), parity_moves, seed = d)
+        for i, differences in mismatches:
+            print(f"INSTANCE {d}: Move {i} differs on {differences}")
+        failures += len(mismatches)
+        print(f"INSTANCE {d}: {parity_moves - len(mismatches)}/{parity_moves} solutions match the validator")
+    print(f"Parity check finished with {failures} mismatches")
+    if(failures > 0):
+        sys.exit(1)
+
+
+# Scaling of the hyper-heuristic with the number of cores
+def bulk_scaling():
+    """
+    Runs the hyper-heuristic on the first instance with 1, 2, 4, ... cores (up to the CPUs available)
+    in both parallel modes and reports how many moves are evaluated per second.
+    """
+    instance_file = '{}/{}'.format(data_folder,sorted(os.listdir(data_folder))[0])
+    with open(instance_file, 'r') as file:
+        raw_data = json.load(file)
+    core_counts = [1]
+    while(core_counts[-1]*2 <= available_cores()):
+        core_counts.append(core_counts[-1]*2)
+    if(core_counts[-1] != available_cores()):
+        core_counts.append(available_cores())
+    results = []
+    for parallel_mode in ["sync", "async"]:
+        for cores in core_counts:
+            rd.seed(cores)
+            optimiser = Optimiser(raw_data,
+                                  instance_file_name = instance_file,
+                                  time_limit = scaling_time,
+                                  time_tolerance = 0,
+                                  heuristic_selection = "random",
+                                  parallel_mode = parallel_mode,
+                                  cores = cores)
+            optimiser.improvement_hyper_heuristic(optimiser.optimise(method = "greedy"))
+            results.append((parallel_mode, cores, optimiser.moves_evaluated/scaling_time))
+    print(f"Scaling on {instance_file} ({scaling_time} seconds per run)")
+    for parallel_mode, cores, rate in results:
+        print(f"{parallel_mode:>5} {cores:>3} cores: {rate:.1f} moves/s")
+
+
 # Doing things
 if(args.run):
     bulk_run()
 elif(args.check):
     bulk_check()
+elif(args.parity):
+    bulk_parity()
+elif(args.scaling):
+    bulk_scaling()
 else:
     print("No argument selected!")
     print("--run   : Batch run instances.")
-    print("--check : Batch check instances.")
\ No newline at end of file
+    print("--check : Batch check instances.")
+    print("--parity: Check the python evaluator against the validator.")
+    print("--scaling: Moves per second of the hyper-heuristic against the number of cores.")
\ No newline at end of file
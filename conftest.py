@@ -0,0 +1 @@
+# Makes the src package importable when pytest is run from the repository root
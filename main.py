@@ -21,16 +21,25 @@ if __name__ == "__main__":
         parser.add_argument('--time_tolerance',type=float,default="5")
         parser.add_argument('--plot',action='store_true')
         parser.add_argument('--verbose',action='store_true')
-        parser.add_argument('--selection',type=str,default="random",choices=["qlearner","random","mcrl","none"])
+        parser.add_argument('--debug',action='store_true')
+        parser.add_argument('--selection',type=str,default="random",choices=["qlearner","random","mcrl","pursuit","none"])
         parser.add_argument('--acceptance',type=str,default="sa",choices=["improve_only","r2r","sa","none"])
         parser.add_argument('--sequence_length',type=int,default=0)
+        parser.add_argument('--evaluator',type=str,default="python",choices=["python","validator"])
+        parser.add_argument('--parallel',type=str,default="sync",choices=["sync","async"])
+        parser.add_argument('--cores',type=int,default=4) # Competition setting, 0 uses every CPU available to the process
+        parser.add_argument('--pool_size',type=int,default=0) # 0 uses one solution per core
+        parser.add_argument('--starts',type=int,default=0) # Randomised greedy starts run on the cores (0 or 1 for the single greedy)
+        parser.add_argument('--moves',type=str,default="") # Comma separated low level heuristics to use (default all)
+        parser.add_argument('--disabled_moves',type=str,default="") # Comma separated low level heuristics not to use
         parser.add_argument('--save_costs',action='store_true')
         parser.add_argument('--costs_folder',type=str,default="data/individual_costs")
+        parser.add_argument('--telemetry_folder',type=str,default="data/telemetry") # Statistics of each low level heuristic
         args = parser.parse_args()
 
         # Set the sequence length to be 1 if we are using random and 10 for the Q-Learner if not set explicitly
         if args.sequence_length == 0:
-            if args.selection == "random":
+            if args.selection == "random" or args.selection == "pursuit":
                 args.sequence_length = 1
             elif args.selection == "qlearner":
                 args.sequence_length = 4
@@ -58,6 +67,12 @@ if __name__ == "__main__":
             else:
                 raise ValueError("Invalid output folder")
             
+        # Constructing telemetry path
+        telemetry_file = None
+        if(len(args.telemetry_folder) > 0):
+            os.makedirs(args.telemetry_folder, exist_ok=True)
+            telemetry_file = "{}/{}_{}_{}".format(args.telemetry_folder, os.path.basename(filename), args.selection, args.acceptance)
+
         # Running optimisation
         solution, costs = main(filename_and_path,
                                seed = args.seed,
@@ -66,11 +81,19 @@ if __name__ == "__main__":
                                verbose = args.verbose,
                                heuristic_selection=args.selection,
                                sequence_length=args.sequence_length,
-                               acceptance_selection=args.acceptance)
+                               acceptance_selection=args.acceptance,
+                               evaluator=args.evaluator,
+                               debug=args.debug,
+                               parallel_mode=args.parallel,
+                               cores=args.cores,
+                               pool_size=args.pool_size,
+                               starts=args.starts,
+                               moves=[name for name in args.moves.split(",") if name],
+                               disabled_moves=[name for name in args.disabled_moves.split(",") if name],
+                               telemetry_file=telemetry_file)
 
         # Saving solution
         with open("{}sol_{}.json".format(args.output_folder,filename), "w") as outfile: 
-            #solution.pop('operator')
             json.dump(solution, outfile, indent=2)
 
         # Save costs
@@ -2,6 +2,8 @@
 Class object to hold all of the instance data
 """
 
+import numpy as np
+
 class Data():
     def __init__(self, raw_data):
         # Instance
@@ -19,15 +21,66 @@ class Data():
             for shift in self.shift_types:
                 self.shift_index_dict[(d,shift)] = len(self.shift_index_dict)
         
-        # # Room information
-        # self.room_capacity_dict = {}
-        # for room in data["rooms"]:
-        #     self.room_capacity_dict[room["id"]] = room["capacity"]
+        self.shifts_per_day = len(self.shift_types)
+        self.nshifts = self.ndays*self.shifts_per_day
+
+        # Integer indices (solutions are arrays indexed by these, ids are only used in the JSON format)
+        self.room_ids = [room["id"] for room in raw_data["rooms"]]
+        self.theater_ids = [theater["id"] for theater in raw_data["operating_theaters"]]
+        self.surgeon_ids = [surgeon["id"] for surgeon in raw_data["surgeons"]]
+        self.patient_ids = [patient["id"] for patient in raw_data["patients"]]
+        self.occupant_ids = [occupant["id"] for occupant in raw_data["occupants"]]
+        self.nurse_ids = [nurse["id"] for nurse in raw_data["nurses"]]
+        self.room_index = {room_id: i for i, room_id in enumerate(self.room_ids)}
+        self.theater_index = {theater_id: i for i, theater_id in enumerate(self.theater_ids)}
+        self.surgeon_index = {surgeon_id: i for i, surgeon_id in enumerate(self.surgeon_ids)}
+        self.patient_index = {patient_id: i for i, patient_id in enumerate(self.patient_ids)}
+        self.nurse_index = {nurse_id: i for i, nurse_id in enumerate(self.nurse_ids)}
+        self.gender_index = {"A": 0, "B": 1}
+
+        # Capacities indexed by [day, room/theater/surgeon]
+        self.room_capacity = np.array([room["capacity"] for room in raw_data["rooms"]])
+        self.theater_availability = np.array([theater["availability"] for theater in raw_data["operating_theaters"]]).reshape(-1,self.ndays).T
+        self.surgeon_max_time = np.array([surgeon["max_surgery_time"] for surgeon in raw_data["surgeons"]]).reshape(-1,self.ndays).T
+
+        # Age group to index (age mixing is measured on this scale)
+        self.age_group_index = {}
+        for age_group in raw_data["age_groups"]:
+            self.age_group_index[age_group] = len(self.age_group_index)
+
+        # Objective weights
+        self.weights = raw_data["weights"]
+
+        # Room information
+        self.room_capacity_dict = {}
+        for room in raw_data["rooms"]:
+            self.room_capacity_dict[room["id"]] = room["capacity"]
 
-        # # Theater information
-        # self.theater_capacity_dict = {}
-        # for theater in data["operating_theaters"]:
-        #     self.theater_capacity_dict[theater["id"]] = theater["availability"]
+        # Theater information
+        self.theater_capacity_dict = {}
+        for theater in raw_data["operating_theaters"]:
+            self.theater_capacity_dict[theater["id"]] = theater["availability"]
+
+        # Surgeon information
+        self.surgeon_capacity_dict = {}
+        for surgeon in raw_data["surgeons"]:
+            self.surgeon_capacity_dict[surgeon["id"]] = surgeon["max_surgery_time"]
+
+        # Occupant information
+        self.occupant_dict = {}
+        for occupant in raw_data["occupants"]:
+            self.occupant_dict[occupant["id"]] = {
+                "gender": occupant["gender"],
+                "age_group": occupant["age_group"],
+                "length_of_stay": occupant["length_of_stay"],
+                "workload_produced": occupant["workload_produced"],
+                "skill_level_required": occupant["skill_level_required"],
+                "room_id": occupant["room_id"],
+                "room": self.room_index[occupant["room_id"]],
+                "gender_index": self.gender_index[occupant["gender"]],
+                "age_index": self.age_group_index[occupant["age_group"]]
+            }
+        self.occupant_list = [self.occupant_dict[occupant_id] for occupant_id in self.occupant_ids]
 
         # Patient information
         self.patient_dict = {}
@@ -41,18 +94,88 @@ class Data():
                 "skill_level_required": patient["skill_level_required"],
                 "surgeon_id": patient["surgeon_id"],
                 "surgery_duration": patient["surgery_duration"],
+                "surgery_release_day": patient["surgery_release_day"],
+                "last_possible_day": self.patient_last_possible_day(patient),
                 "possible_rooms": self.patient_possible_rooms(patient),
                 "possible_theaters": self.patient_possible_theaters(patient),
-                "possible_admission_days": self.patient_possible_admission_days(patient)
+                "possible_admission_days": self.patient_possible_admission_days(patient),
+                "surgeon": self.surgeon_index[patient["surgeon_id"]],
+                "gender_index": self.gender_index[patient["gender"]],
+                "age_index": self.age_group_index[patient["age_group"]]
             }
+            self.patient_dict[patient["id"]]["room_options"] = [self.room_index[r] for r in self.patient_dict[patient["id"]]["possible_rooms"]]
+            self.patient_dict[patient["id"]]["theater_options"] = [self.theater_index[t] for t in self.patient_dict[patient["id"]]["possible_theaters"]]
+        self.patient_list = [self.patient_dict[patient_id] for patient_id in self.patient_ids]
+        self.patient_is_mandatory = np.array([patient["mandatory"] for patient in self.patient_list], dtype=bool)
+        self.patient_surgeon = np.array([patient["surgeon"] for patient in self.patient_list], dtype=int)
+        self.patient_length_of_stay = np.array([patient["length_of_stay"] for patient in self.patient_list], dtype=int)
+        self.patient_age = np.array([patient["age_index"] for patient in self.patient_list], dtype=int)
+
+        # Patient feasibility lookups indexed by [patient, room] and [patient, day]
+        self.patient_room_compatible = np.zeros((len(self.patient_ids), len(self.room_ids)), dtype=bool)
+        self.patient_day_admissible = np.zeros((len(self.patient_ids), self.ndays), dtype=bool)
+        for p, patient in enumerate(self.patient_list):
+            self.patient_room_compatible[p,patient["room_options"]] = True
+            self.patient_day_admissible[p,patient["possible_admission_days"]] = True
 
         # Nurse information
         self.nurse_dict = {}
         for nurse in raw_data["nurses"]:
             self.nurse_dict[nurse["id"]] = {
                 "skill_level": nurse["skill_level"],
-                "working_shifts": self.nurse_working_shifts(nurse)
+                "working_shifts": self.nurse_working_shifts(nurse),
+                "max_load": self.nurse_max_load(nurse)
             }
+            self.nurse_dict[nurse["id"]]["shifts"] = sorted(self.nurse_dict[nurse["id"]]["max_load"])
+        self.nurse_list = [self.nurse_dict[nurse_id] for nurse_id in self.nurse_ids]
+
+        # Nurse availability indexed by [nurse, shift] (max load 0 when not working) and the nurses working each shift
+        self.nurse_working = np.zeros((len(self.nurse_ids), self.nshifts), dtype=bool)
+        self.nurse_max_load_table = np.zeros((len(self.nurse_ids), self.nshifts), dtype=int)
+        for n, nurse in enumerate(self.nurse_list):
+            for s in nurse["max_load"]:
+                self.nurse_working[n,s] = True
+                self.nurse_max_load_table[n,s] = nurse["max_load"][s]
+        self.shift_nurses = [np.flatnonzero(self.nurse_working[:,s]).tolist() for s in range(self.nshifts)]
+        self.nurse_skill = np.array([nurse["skill_level"] for nurse in self.nurse_list], dtype=int)
+
+        # Every shift of every patient stay, flattened so the workload and skill demand of a solution is built in one pass
+        stays = [(p, k) for p, patient in enumerate(self.patient_list)
+                 for k in range(min(patient["length_of_stay"], self.ndays)*self.shifts_per_day)]
+        self.stay_patient = np.array([p for p, k in stays], dtype=int)
+        self.stay_offset = np.array([k for p, k in stays], dtype=int)
+        self.stay_workload = np.array([self.patient_list[p]["workload_produced"][k] for p, k in stays], dtype=int)
+        self.stay_skill = np.array([self.patient_list[p]["skill_level_required"][k] for p, k in stays], dtype=int)
+
+        # Workload [shift, room] and people requiring each skill level [shift, room, skill level] of the occupants
+        self.occupant_workload = np.zeros((self.nshifts, len(self.room_ids)), dtype=int)
+        self.occupant_skill_demand = np.zeros((self.nshifts, len(self.room_ids), self.skill_levels), dtype=int)
+        for occupant in self.occupant_list:
+            stay = min(occupant["length_of_stay"], self.ndays)*self.shifts_per_day
+            self.occupant_workload[:stay,occupant["room"]] += occupant["workload_produced"][:stay]
+            np.add.at(self.occupant_skill_demand, (np.arange(stay), occupant["room"], occupant["skill_level_required"][:stay]), 1)
+
+        # Youngest and oldest age group [day, room] of the occupants (number of age groups and -1 when there are none)
+        self.occupant_age_min = np.full((self.ndays, len(self.room_ids)), len(self.age_group_index))
+        self.occupant_age_max = np.full((self.ndays, len(self.room_ids)), -1)
+        for occupant in self.occupant_list:
+            stay = min(occupant["length_of_stay"], self.ndays)
+            self.occupant_age_min[:stay,occupant["room"]] = np.minimum(self.occupant_age_min[:stay,occupant["room"]], occupant["age_index"])
+            self.occupant_age_max[:stay,occupant["room"]] = np.maximum(self.occupant_age_max[:stay,occupant["room"]], occupant["age_index"])
+
+        # Skill shortfall of a nurse of level [nurse skill] caring for a person requiring level [required skill]
+        levels = np.arange(self.skill_levels)
+        self.skill_shortfall = np.maximum(0, levels[None,:] - levels[:,None])
+
+        # Random keys of the assignments of every patient ([patient, day/room/theater + 1], index 0 when not scheduled)
+        # and of every nurse assignment ([shift, room, nurse + 1]), to hash solutions incrementally (Zobrist hashing).
+        # The seed is fixed so every process hashes a solution the same way.
+        keys = np.random.default_rng(0)
+        key_limit = np.iinfo(np.uint64).max
+        self.patient_day_key = keys.integers(key_limit, size = (len(self.patient_ids), self.ndays + 1), dtype = np.uint64)
+        self.patient_room_key = keys.integers(key_limit, size = (len(self.patient_ids), len(self.room_ids) + 1), dtype = np.uint64)
+        self.patient_theater_key = keys.integers(key_limit, size = (len(self.patient_ids), len(self.theater_ids) + 1), dtype = np.uint64)
+        self.nurse_key = keys.integers(key_limit, size = (self.nshifts, len(self.room_ids), len(self.nurse_ids) + 1), dtype = np.uint64)
 
         # Some general data items to store to stop the heuristics generating these every time
         self.all_non_mandatory_patients = [patient_id for patient_id in self.patient_dict if not self.patient_dict[patient_id]["mandatory"]]
@@ -70,8 +193,8 @@ class Data():
 
 
     def patient_possible_rooms(self,patient):
-        all_rooms = [r["id"] for r in self.data["rooms"]]
-        room_list = list(set(all_rooms) - set(patient["incompatible_room_ids"]))
+        incompatible_rooms = set(patient["incompatible_room_ids"])
+        room_list = [room_id for room_id in self.room_ids if room_id not in incompatible_rooms]
         return room_list
     
 
@@ -80,17 +203,26 @@ class Data():
         return theater_list
 
 
-    def patient_possible_admission_days(self,patient):
-        patient_days = [d for d in self.all_days if d >= patient["surgery_release_day"]]
+    def patient_last_possible_day(self,patient):
         if(self.patient_mandatory(patient)):
-            mandatory_patient_days = [d for d in patient_days if d <= patient["surgery_due_day"]]
-            return mandatory_patient_days
+            return patient["surgery_due_day"]
         else:
-            return patient_days
+            return self.ndays - 1
+
+
+    def patient_possible_admission_days(self,patient):
+        return list(range(patient["surgery_release_day"], min(self.ndays, self.patient_last_possible_day(patient) + 1)))
         
     
     def nurse_working_shifts(self,nurse):
         shift_list = []
         for shift in nurse["working_shifts"]:
             shift_list.append(shift)
-        return shift_list
\ No newline at end of file
+        return shift_list
+
+
+    def nurse_max_load(self,nurse):
+        max_load = {}
+        for shift in nurse["working_shifts"]:
+            max_load[self.shift_index_dict[(shift["day"],shift["shift"])]] = shift["max_load"]
+        return max_load
\ No newline at end of file
@@ -0,0 +1,279 @@
+"""
+this module contains the array-backed solution used during optimisation.
+
+A solution is a dictionary of NumPy arrays indexed by the integer indices held in Data:
+- "admission_day", "room", "theater": [patient] (-1 when the patient is not scheduled)
+- "nurse": [shift, room] nurse covering the room in the shift (-1 when uncovered)
+- "room_allocation": [day, room] number of patients and occupants in the room
+- "gender_allocation": [day, room, gender] number of patients and occupants of each gender in the room
+- "theater_allocation": [day, theater] remaining theater time
+- "surgeon_allocation": [day, surgeon] remaining surgeon time
+
+The competition JSON format is only used when reading and writing solutions.
+
+Candidate solutions are copy-on-write (see derive_solution): a candidate shares the arrays of the solution it came from
+and an array is only copied the first time the candidate changes it, so every write goes through writable().
+
+A solution may also hold its "hash" (see solution_hash), kept up to date by assign_patient, unassign_patient and set_nurse.
+Code writing the assignments in any other way must drop it.
+"""
+
+import numpy as np
+
+def new_solution(data):
+    """
+    Returns a solution with no patients scheduled and no nurses assigned (occupants are in their rooms).
+    """
+    npatients = len(data.patient_ids)
+    solution = {"admission_day": np.full(npatients, -1),
+                "room": np.full(npatients, -1),
+                "theater": np.full(npatients, -1),
+                "nurse": np.full((data.nshifts, len(data.room_ids)), -1),
+                "room_allocation": np.zeros((data.ndays, len(data.room_ids)), dtype=int),
+                "gender_allocation": np.zeros((data.ndays, len(data.room_ids), 2), dtype=int),
+                "theater_allocation": data.theater_availability.copy(),
+                "surgeon_allocation": data.surgeon_max_time.copy()}
+
+    # Adding in occupants
+    for occupant in data.occupant_list:
+        stay = min(occupant["length_of_stay"], data.ndays)
+        solution["room_allocation"][:stay,occupant["room"]] += 1
+        solution["gender_allocation"][:stay,occupant["room"],occupant["gender_index"]] += 1
+    return solution
+
+
+def copy_solution(solution):
+    """
+    Returns an independent copy of a solution (the arrays are small so copying them is cheap).
+    """
+    new_solution = {}
+    for key in solution:
+        if(key == "shared"):
+            continue # The copied arrays belong to the copy only
+        elif(isinstance(solution[key], np.ndarray)):
+            new_solution[key] = solution[key].copy()
+        elif(isinstance(solution[key], list)):
+            new_solution[key] = list(solution[key])
+        else:
+            new_solution[key] = solution[key]
+    return new_solution
+
+
+def derive_solution(solution):
+    """
+    Returns a candidate solution sharing the arrays of solution, which moves can change without touching solution.
+    """
+    new_solution = {key: solution[key] for key in solution if isinstance(solution[key], np.ndarray)}
+    new_solution["shared"] = set(new_solution)
+    new_solution["changes"] = []
+    new_solution["operator"] = solution.get("operator")
+    if("hash" in solution):
+        new_solution["hash"] = solution["hash"]
+    return new_solution
+
+
+def writable(solution, key):
+    """
+    Returns the array of a solution under key, copying it first if it is still shared with another solution.
+    """
+    shared = solution.get("shared")
+    if(shared and key in shared):
+        solution[key] = solution[key].copy()
+        shared.discard(key)
+    return solution[key]
+
+
+def restore_solution(solution, snapshot):
+    """
+    Puts the arrays of a solution back to a copy taken with copy_solution (in place, so references stay valid).
+    """
+    solution.pop("hash", None)
+    for key in snapshot:
+        if(isinstance(snapshot[key], np.ndarray)):
+            writable(solution, key)[...] = snapshot[key]
+        elif(key != "shared"):
+            solution[key] = snapshot[key]
+
+
+"""
+Patient assignment and allocation bookkeeping
+"""
+
+def assign_patient(data, solution, p, d, r, t):
+    if("hash" in solution):
+        solution["hash"] ^= patient_key(data, p, -1, -1, -1) ^ patient_key(data, p, d, r, t)
+    writable(solution, "admission_day")[p] = d
+    writable(solution, "room")[p] = r
+    writable(solution, "theater")[p] = t
+    allocate_patient(data, solution, p, d, r, t)
+
+
+def unassign_patient(data, solution, p):
+    if("hash" in solution):
+        solution["hash"] ^= patient_key(data, p, *patient_assignment(solution, p)) ^ patient_key(data, p, -1, -1, -1)
+    deallocate_patient(data, solution, p, solution["admission_day"][p], solution["room"][p], solution["theater"][p])
+    writable(solution, "admission_day")[p] = -1
+    writable(solution, "room")[p] = -1
+    writable(solution, "theater")[p] = -1
+
+
+def set_nurse(data, solution, s, r, n):
+    """
+    Sets the nurse covering room r in shift s (-1 to leave it uncovered)
+    """
+    if("hash" in solution):
+        solution["hash"] ^= int(data.nurse_key[s,r,solution["nurse"][s,r]+1] ^ data.nurse_key[s,r,n+1])
+    writable(solution, "nurse")[s,r] = n
+
+
+def patient_assignment(solution, p):
+    """
+    Returns the (day, room, theater) of a patient or None if not scheduled
+    """
+    d = solution["admission_day"][p]
+    if(d < 0):
+        return None
+    return (int(d), int(solution["room"][p]), int(solution["theater"][p]))
+
+
+def allocate_patient(data, solution, p, d, r, t):
+    patient = data.patient_list[p]
+    stay_end = min(data.ndays, d + patient["length_of_stay"])
+    writable(solution, "room_allocation")[d:stay_end,r] += 1
+    writable(solution, "gender_allocation")[d:stay_end,r,patient["gender_index"]] += 1
+    writable(solution, "theater_allocation")[d,t] -= patient["surgery_duration"]
+    writable(solution, "surgeon_allocation")[d,patient["surgeon"]] -= patient["surgery_duration"]
+
+
+def deallocate_patient(data, solution, p, d, r, t):
+    patient = data.patient_list[p]
+    stay_end = min(data.ndays, d + patient["length_of_stay"])
+    writable(solution, "room_allocation")[d:stay_end,r] -= 1
+    writable(solution, "gender_allocation")[d:stay_end,r,patient["gender_index"]] -= 1
+    writable(solution, "theater_allocation")[d,t] += patient["surgery_duration"]
+    writable(solution, "surgeon_allocation")[d,patient["surgeon"]] += patient["surgery_duration"]
+
+
+"""
+Hashing
+"""
+
+def patient_key(data, p, d, r, t):
+    return int(data.patient_day_key[p,d+1] ^ data.patient_room_key[p,r+1] ^ data.patient_theater_key[p,t+1])
+
+
+def solution_hash(data, solution):
+    """
+    Returns a 64 bit hash of the patient and nurse assignments: the XOR of the keys (in Data) of every assignment.
+    The hash is stored in the solution, the functions changing assignments then update it with two XORs.
+    """
+    if("hash" not in solution):
+        patients = np.arange(len(data.patient_ids))
+        nurse = solution["nurse"]
+        keys = np.concatenate([data.patient_day_key[patients,solution["admission_day"]+1],
+                               data.patient_room_key[patients,solution["room"]+1],
+                               data.patient_theater_key[patients,solution["theater"]+1],
+                               data.nurse_key[np.arange(data.nshifts)[:,None],np.arange(nurse.shape[1])[None,:],nurse+1].ravel()])
+        solution["hash"] = int(np.bitwise_xor.reduce(keys))
+    return solution["hash"]
+
+
+def update_allocations(data, solution):
+    """
+    Rebuilds all of the allocations from the patient assignments
+    """
+    allocations = new_solution(data)
+    for p in np.flatnonzero(solution["admission_day"] >= 0):
+        allocate_patient(data, allocations, p, solution["admission_day"][p], solution["room"][p], solution["theater"][p])
+    for key in ["room_allocation", "gender_allocation", "theater_allocation", "surgeon_allocation"]:
+        solution[key] = allocations[key]
+        solution.get("shared", set()).discard(key)
+    return solution
+
+
+def check_allocations(data, solution):
+    """
+    Checks the allocations match a full rebuild (debugging the incremental updates made by the moves)
+    """
+    expected = update_allocations(data, {"admission_day": solution["admission_day"],
+                                         "room": solution["room"],
+                                         "theater": solution["theater"]})
+    for key in ["room_allocation", "gender_allocation", "theater_allocation", "surgeon_allocation"]:
+        if(not np.array_equal(expected[key], solution[key])):
+            raise RuntimeError("{} differs from a full rebuild".format(key))
+
+
+def room_shift_demand(data, solution):
+    """
+    Returns the nurse workload [shift, room] and the number of people requiring each skill level [shift, room, skill level]
+    of the occupants and scheduled patients, built in one vectorised pass over every shift of every stay.
+    """
+    nrooms = len(data.room_ids)
+    admission_day = solution["admission_day"][data.stay_patient]
+    shift = admission_day*data.shifts_per_day + data.stay_offset
+    scheduled = (admission_day >= 0) & (shift < data.nshifts)
+    index = shift[scheduled]*nrooms + solution["room"][data.stay_patient[scheduled]]
+    workload = np.bincount(index, weights = data.stay_workload[scheduled], minlength = data.nshifts*nrooms)
+    workload = workload.astype(int).reshape(data.nshifts, nrooms) + data.occupant_workload
+    skill_demand = np.bincount(index*data.skill_levels + data.stay_skill[scheduled], minlength = data.nshifts*nrooms*data.skill_levels)
+    skill_demand = skill_demand.reshape(data.nshifts, nrooms, data.skill_levels) + data.occupant_skill_demand
+    return workload, skill_demand
+
+
+"""
+Converting to and from the competition JSON format
+"""
+
+def solution_to_json(data, solution):
+    solution_json = {"patients": [], "nurses": []}
+    for p in range(len(data.patient_ids)):
+        assignment = patient_assignment(solution, p)
+        if(assignment is None):
+            solution_json["patients"].append({"id": data.patient_ids[p], "admission_day": "none"})
+        else:
+            d, r, t = assignment
+            solution_json["patients"].append({"id": data.patient_ids[p],
+                                              "admission_day": d,
+                                              "room": data.room_ids[r],
+                                              "operating_theater": data.theater_ids[t]})
+
+    # Nurse assignments grouped by shift (argwhere is ordered by shift then room)
+    nurse_assignments = {}
+    for s, r in np.argwhere(solution["nurse"] >= 0):
+        n = solution["nurse"][s,r]
+        assignments = nurse_assignments.setdefault(n, [])
+        if(len(assignments) == 0 or assignments[-1][0] != s):
+            assignments.append((s, []))
+        assignments[-1][1].append(data.room_ids[r])
+    for n in sorted(nurse_assignments):
+        solution_json["nurses"].append({"id": data.nurse_ids[n],
+                                        "assignments": [{"day": int(s)//data.shifts_per_day,
+                                                         "shift": data.shift_types[s%data.shifts_per_day],
+                                                         "rooms": rooms}
+                                                        for s, rooms in nurse_assignments[n]]})
+    return solution_json
+
+
+def solution_from_json(data, solution_json):
+    """
+    Reads a competition solution. If several nurses cover a room in a shift, the last one is kept
+    (this is the nurse the validator considers to be caring for the patients).
+    """
+    solution = new_solution(data)
+    for entry in solution_json["patients"]:
+        if(entry["admission_day"] == "none"):
+            continue
+        p = data.patient_index[entry["id"]]
+        if(solution["admission_day"][p] >= 0):
+            raise ValueError("Patient {} assigned twice in the solution".format(entry["id"]))
+        assign_patient(data, solution, p,
+                       entry["admission_day"],
+                       data.room_index[entry["room"]],
+                       data.theater_index[entry["operating_theater"]])
+    for nurse_entry in solution_json["nurses"]:
+        n = data.nurse_index[nurse_entry["id"]]
+        for assignment in nurse_entry["assignments"]:
+            s = data.shift_index_dict[(assignment["day"],assignment["shift"])]
+            for room_id in assignment["rooms"]:
+                solution["nurse"][s,data.room_index[room_id]] = n
+    return solution
@@ -0,0 +1,438 @@
+"""
+this module contains a python implementation of the IHTP_Validator.
+
+Solutions (see src/data/solution.py) are scored in-process rather than by writing them to a file and calling ./bin/IHTP_Validator.
+The hard constraint violations and soft costs are computed cell by cell (room/day, room/shift, nurse/shift,
+theater/day, surgeon/day, patient and occupant) so the same totals as the validator are produced.
+"""
+
+import numpy as np
+import src.data.solution as sol
+
+# Hard constraints in the order the validator reports them
+VIOLATIONS = ["RoomGenderMix",
+              "PatientRoomCompatibility",
+              "SurgeonOvertime",
+              "OperatingTheaterOvertime",
+              "MandatoryUnscheduledPatients",
+              "AdmissionDay",
+              "RoomCapacity",
+              "NursePresence",
+              "UncoveredRoom"]
+
+# Soft costs in the order the validator reports them, with the name of their weight in the instance
+COSTS = {"RoomAgeMix": "room_mixed_age",
+         "RoomSkillLevel": "room_nurse_skill",
+         "ContinuityOfCare": "continuity_of_care",
+         "ExcessiveNurseWorkload": "nurse_eccessive_workload",
+         "OpenOperatingTheater": "open_operating_theater",
+         "SurgeonTransfer": "surgeon_transfer",
+         "PatientDelay": "patient_delay",
+         "ElectiveUnscheduledPatients": "unscheduled_optional"}
+
+# Components each type of cell contributes to
+CELL_COMPONENTS = {"room_day": ("RoomGenderMix", "RoomCapacity", "RoomAgeMix"),
+                   "room_shift": ("UncoveredRoom", "NursePresence", "RoomSkillLevel"),
+                   "nurse_shift": ("ExcessiveNurseWorkload",),
+                   "theater_day": ("OperatingTheaterOvertime", "OpenOperatingTheater"),
+                   "surgeon_day": ("SurgeonOvertime", "SurgeonTransfer"),
+                   "patient": ("MandatoryUnscheduledPatients",
+                               "ElectiveUnscheduledPatients",
+                               "AdmissionDay",
+                               "PatientRoomCompatibility",
+                               "PatientDelay",
+                               "ContinuityOfCare"),
+                   "occupant": ("ContinuityOfCare",)}
+
+
+def evaluate(data, solution):
+    """
+    Returns the number of violations, the total (weighted) cost and the violated constraints of a solution.
+    """
+    return Evaluation(data, solution).summary()
+
+
+def evaluate_costs(data, solution):
+    """
+    Returns the weighted value of each soft cost of a solution.
+    """
+    return Evaluation(data, solution).weighted_costs()
+
+
+class Evaluation():
+    """
+    Holds the room, nurse, theater and surgeon usage of a solution along with the violations and costs
+    produced by every cell of the problem.
+
+    Patients and occupants are both "people": person p < npatients is patient p, otherwise occupant p - npatients.
+
+    Mirrors the behaviour of the validator:
+    - Patients staying beyond the scheduling period are only counted within it.
+    - Nurses assigned outside their working shifts count as NursePresence violations (the validator aborts).
+    - Uncovered rooms count towards UncoveredRoom only, not RoomSkillLevel (there is no nurse skill level to compare with).
+
+    With the summary of the solution already known (parent), no cell is scored up front: cells are scored as the changes
+    first touch them and the totals only hold the differences from the parent.
+    """
+
+    def __init__(self, data, solution, parent = None):
+        self.data = data
+        self.shifts_per_day = data.shifts_per_day
+        self.npatients = len(data.patient_list)
+        self.people = data.patient_list + data.occupant_list
+
+        # Solution structures
+        self.admission = {} # patient: (day, room, theater)
+        self.room_day = {} # (room, day): [people]
+        self.nurse = None # [shift][room]: nurse or -1
+        self.nurse_shift_rooms = {} # (nurse, shift): [rooms]
+        self.theater_day = {} # (theater, day): [patients]
+        self.surgeon_day = {} # (surgeon, day): [patients]
+
+        # Cost tracking
+        self.cells = {}
+        self.totals = {name: 0 for name in VIOLATIONS + list(COSTS)}
+        self.cell_functions = {"room_day": self.room_day_cost,
+                               "room_shift": self.room_shift_cost,
+                               "nurse_shift": self.nurse_shift_cost,
+                               "theater_day": self.theater_day_cost,
+                               "surgeon_day": self.surgeon_day_cost,
+                               "patient": self.patient_cost,
+                               "occupant": self.occupant_cost}
+
+        self.parent = parent
+        self.read_solution(solution)
+        if(parent is None):
+            self.score_shift_cells(solution)
+            for cell in self.all_cells():
+                self.update_cell(cell)
+
+    """
+    Building the solution structures
+    """
+
+    def read_solution(self, solution):
+        data = self.data
+        for r in range(len(data.room_ids)):
+            for d in data.all_days:
+                self.room_day[(r,d)] = []
+        for t in range(len(data.theater_ids)):
+            for d in data.all_days:
+                self.theater_day[(t,d)] = []
+        for u in range(len(data.surgeon_ids)):
+            for d in data.all_days:
+                self.surgeon_day[(u,d)] = []
+
+        # Occupants are always present from day zero
+        for o, occupant in enumerate(data.occupant_list):
+            for d in range(min(occupant["length_of_stay"], data.ndays)):
+                self.room_day[(occupant["room"],d)].append(self.npatients + o)
+
+        # Patients
+        for p in range(self.npatients):
+            if(solution["admission_day"][p] >= 0):
+                self.assign_patient(p, int(solution["admission_day"][p]), int(solution["room"][p]), int(solution["theater"][p]))
+
+        # Nurses (copied as the solution arrays are changed in place by the moves)
+        self.nurse = solution["nurse"].tolist()
+        for s, nurses in enumerate(self.nurse):
+            for r, n in enumerate(nurses):
+                if(n >= 0):
+                    self.nurse_shift_rooms.setdefault((n,s), []).append(r)
+
+    def assign_patient(self, p, d, r, t):
+        patient = self.people[p]
+        self.admission[p] = (d, r, t)
+        for i in range(d, min(self.data.ndays, d + patient["length_of_stay"])):
+            self.room_day[(r,i)].append(p)
+        self.theater_day[(t,d)].append(p)
+        self.surgeon_day[(patient["surgeon"],d)].append(p)
+
+    def unassign_patient(self, p):
+        d, r, t = self.admission.pop(p)
+        patient = self.people[p]
+        for i in range(d, min(self.data.ndays, d + patient["length_of_stay"])):
+            self.room_day[(r,i)].remove(p)
+        self.theater_day[(t,d)].remove(p)
+        self.surgeon_day[(patient["surgeon"],d)].remove(p)
+
+    def assign_nurse(self, n, s, r):
+        self.nurse[s][r] = n
+        self.nurse_shift_rooms.setdefault((n,s), []).append(r)
+
+    def unassign_nurse(self, n, s, r):
+        self.nurse[s][r] = -1
+        self.nurse_shift_rooms[(n,s)].remove(r)
+
+    def all_cells(self):
+        """
+        Returns every cell which can produce a violation or cost (empty rooms, theaters and surgeons cannot),
+        apart from the room/shift and nurse/shift cells which are scored together by score_shift_cells
+        """
+        data = self.data
+        cells = []
+        for (r,d) in self.room_day:
+            if(len(self.room_day[(r,d)]) > 0):
+                cells.append(("room_day", r, d))
+        for (t,d) in self.theater_day:
+            if(len(self.theater_day[(t,d)]) > 0):
+                cells.append(("theater_day", t, d))
+        for (u,d) in self.surgeon_day:
+            if(len(self.surgeon_day[(u,d)]) > 0):
+                cells.append(("surgeon_day", u, d))
+        for p in range(self.npatients):
+            cells.append(("patient", p))
+        for o in range(len(data.occupant_list)):
+            cells.append(("occupant", o))
+        return cells
+
+    def score_shift_cells(self, solution):
+        """
+        Scores every room/shift and nurse/shift cell at once from the workload and skill demand arrays
+        (same values as room_shift_cost and nurse_shift_cost)
+        """
+        data = self.data
+        nurse = solution["nurse"]
+        workload, skill_demand = sol.room_shift_demand(data, solution)
+        occupied = np.repeat(solution["room_allocation"] > 0, self.shifts_per_day, axis = 0)
+        covered = nurse >= 0
+        shifts = np.arange(data.nshifts)[:,None]
+        caring_nurse = np.where(covered, nurse, 0)
+
+        # Room/shift cells
+        uncovered = occupied & ~covered
+        presence = covered & ~data.nurse_working[caring_nurse, shifts]
+        shortfall = data.skill_shortfall[data.nurse_skill[caring_nurse]]
+        skill = np.where(covered, (shortfall*skill_demand).sum(axis = 2), 0)
+        cells = np.argwhere(occupied | covered)
+        values = np.stack([uncovered, presence, skill], axis = 2)[cells[:,0], cells[:,1]].astype(int).tolist()
+        self.cells.update(zip([("room_shift", r, s) for s, r in cells.tolist()], map(tuple, values)))
+        self.totals["UncoveredRoom"] += int(uncovered.sum())
+        self.totals["NursePresence"] += int(presence.sum())
+        self.totals["RoomSkillLevel"] += int(skill.sum())
+
+        # Nurse/shift cells (only nurses working the shift)
+        load = np.zeros((len(data.nurse_list), data.nshifts), dtype = int)
+        np.add.at(load, (nurse[covered], np.nonzero(covered)[0]), workload[covered])
+        excess = np.maximum(0, load - data.nurse_max_load_table)
+        for n, s in self.nurse_shift_rooms:
+            if(data.nurse_working[n,s]):
+                self.cells[("nurse_shift", n, s)] = (int(excess[n,s]),)
+                self.totals["ExcessiveNurseWorkload"] += int(excess[n,s])
+
+    """
+    Incremental evaluation
+    """
+
+    def apply_changes(self, changes):
+        """
+        Applies the changes recorded by the low level heuristics and only rescores the cells they touched.
+        Changes are either:
+        - ("patient", patient, old_assignment, new_assignment) with assignments (day, room, theater) or None
+        - ("nurse", shift, room, old_nurse, new_nurse) with nurses -1 when the room is uncovered
+        """
+        cells = set()
+        for change in changes:
+            if(change[0] == "patient"):
+                p, old, new = change[1:]
+                if(old is not None):
+                    cells.update(self.known_cells(self.patient_cells(p)))
+                    self.unassign_patient(p)
+                if(new is not None):
+                    cells.update(self.known_cells(self.patient_cells(p, new)))
+                    self.assign_patient(p, *new)
+            else:
+                s, r, old_nurse, new_nurse = change[1:]
+                if(old_nurse >= 0):
+                    cells.update(self.known_cells(self.nurse_cells(old_nurse, s, r)))
+                    self.unassign_nurse(old_nurse, s, r)
+                if(new_nurse >= 0):
+                    cells.update(self.known_cells(self.nurse_cells(new_nurse, s, r)))
+                    self.assign_nurse(new_nurse, s, r)
+        for cell in cells:
+            self.update_cell(cell)
+
+    def revert_changes(self, changes):
+        """
+        Undoes changes previously applied with apply_changes.
+        """
+        inverse = []
+        for change in reversed(changes):
+            if(change[0] == "patient"):
+                inverse.append(("patient", change[1], change[3], change[2]))
+            else:
+                inverse.append(("nurse", change[1], change[2], change[4], change[3]))
+        self.apply_changes(inverse)
+
+    def known_cells(self, cells):
+        """
+        Scores the cells not scored yet before a change touches them (only needed when built from a parent summary)
+        """
+        if(self.parent is not None):
+            for cell in cells:
+                if(cell not in self.cells):
+                    self.cells[cell] = self.cell_functions[cell[0]](*cell[1:])
+        return cells
+
+    def patient_cells(self, p, assignment = None):
+        """
+        Cells whose value depends on where an (assigned) patient is, or would be with assignment
+        """
+        d, r, t = assignment if assignment is not None else self.admission[p]
+        patient = self.people[p]
+        nurse_list = self.data.nurse_list
+        cells = [("patient", p),
+                 ("theater_day", t, d),
+                 ("surgeon_day", patient["surgeon"], d)]
+        for i in range(d, min(self.data.ndays, d + patient["length_of_stay"])):
+            cells.append(("room_day", r, i))
+            for s in range(i*self.shifts_per_day, (i+1)*self.shifts_per_day):
+                cells.append(("room_shift", r, s))
+                n = self.nurse[s][r]
+                if(n >= 0 and s in nurse_list[n]["max_load"]):
+                    cells.append(("nurse_shift", n, s))
+        return cells
+
+    def nurse_cells(self, n, s, r):
+        """
+        Cells whose value depends on a nurse covering a room in a shift
+        """
+        cells = [("room_shift", r, s)]
+        if(s in self.data.nurse_list[n]["max_load"]):
+            cells.append(("nurse_shift", n, s))
+        for person in self.room_day[(r,s//self.shifts_per_day)]:
+            if(person >= self.npatients):
+                cells.append(("occupant", person - self.npatients))
+            else:
+                cells.append(("patient", person))
+        return cells
+
+    """
+    Cost tracking
+    """
+
+    def update_cell(self, cell):
+        """
+        Recomputes the violations/costs of a single cell and updates the totals
+        """
+        new_values = self.cell_functions[cell[0]](*cell[1:])
+        old_values = self.cells.get(cell)
+        if(new_values == old_values):
+            return
+        totals = self.totals
+        if(old_values is None):
+            for name, new in zip(CELL_COMPONENTS[cell[0]], new_values):
+                totals[name] += new
+        else:
+            for name, new, old in zip(CELL_COMPONENTS[cell[0]], new_values, old_values):
+                totals[name] += new - old
+        self.cells[cell] = new_values
+
+    def violations(self):
+        violations = sum(self.totals[name] for name in VIOLATIONS)
+        if(self.parent is not None):
+            violations += self.parent["Violations"]
+        return violations
+
+    def weighted_costs(self):
+        return {name: self.totals[name]*self.data.weights[COSTS[name]] for name in COSTS}
+
+    def cost(self):
+        cost = sum(self.weighted_costs().values())
+        if(self.parent is not None):
+            cost += self.parent["Cost"]
+        return cost
+
+    def reasons(self):
+        if(self.parent is not None):
+            # Only the differences are known: a violation of the parent is kept even if the changes removed it
+            return [name for name in VIOLATIONS if name in self.parent["Reasons"] or self.totals[name] > 0]
+        return [name for name in VIOLATIONS if self.totals[name] != 0]
+
+    def summary(self):
+        return {"Violations": self.violations(), "Cost": self.cost(), "Reasons": self.reasons()}
+
+    """
+    Cell costs
+    """
+
+    def shift_offset(self, person):
+        """
+        Returns the shift at which the stay of a patient or occupant starts
+        """
+        if(person >= self.npatients):
+            return 0
+        return self.admission[person][0]*self.shifts_per_day
+
+    def room_day_cost(self, r, d):
+        people = self.room_day[(r,d)]
+        if(len(people) == 0):
+            return (0, 0, 0)
+        gender_b = 0
+        ages = []
+        for person in people:
+            gender_b += self.people[person]["gender_index"]
+            ages.append(self.people[person]["age_index"])
+        gender_mix = min(gender_b, len(people) - gender_b)
+        over_capacity = max(0, len(people) - int(self.data.room_capacity[r]))
+        return (gender_mix, over_capacity, max(ages) - min(ages))
+
+    def room_shift_cost(self, r, s):
+        people = self.room_day[(r,s//self.shifts_per_day)]
+        n = self.nurse[s][r]
+        if(n < 0):
+            return (1 if len(people) > 0 else 0, 0, 0)
+        nurse = self.data.nurse_list[n]
+        presence = 0 if s in nurse["max_load"] else 1
+        skill = 0
+        for person in people:
+            required = self.people[person]["skill_level_required"][s-self.shift_offset(person)]
+            skill += max(0, required - nurse["skill_level"])
+        return (0, presence, skill)
+
+    def nurse_shift_cost(self, n, s):
+        load = 0
+        for r in self.nurse_shift_rooms.get((n,s), []):
+            for person in self.room_day[(r,s//self.shifts_per_day)]:
+                load += self.people[person]["workload_produced"][s-self.shift_offset(person)]
+        return (max(0, load - self.data.nurse_list[n]["max_load"][s]),)
+
+    def theater_day_cost(self, t, d):
+        patients = self.theater_day[(t,d)]
+        if(len(patients) == 0):
+            return (0, 0)
+        time = sum(self.people[p]["surgery_duration"] for p in patients)
+        return (max(0, time - int(self.data.theater_availability[d,t])), 1)
+
+    def surgeon_day_cost(self, u, d):
+        patients = self.surgeon_day[(u,d)]
+        if(len(patients) == 0):
+            return (0, 0)
+        time = sum(self.people[p]["surgery_duration"] for p in patients)
+        theaters = set(self.admission[p][2] for p in patients)
+        return (max(0, time - int(self.data.surgeon_max_time[d,u])), len(theaters) - 1)
+
+    def patient_cost(self, p):
+        patient = self.people[p]
+        if(p not in self.admission):
+            if(patient["mandatory"]):
+                return (1, 0, 0, 0, 0, 0)
+            return (0, 1, 0, 0, 0, 0)
+        d, r, t = self.admission[p]
+        admission_day = 0 if self.data.patient_day_admissible[p,d] else 1
+        compatibility = 0 if self.data.patient_room_compatible[p,r] else 1
+        delay = max(0, d - patient["surgery_release_day"])
+        continuity = self.count_distinct_nurses(r, d, patient["length_of_stay"])
+        return (0, 0, admission_day, compatibility, delay, continuity)
+
+    def occupant_cost(self, o):
+        occupant = self.data.occupant_list[o]
+        return (self.count_distinct_nurses(occupant["room"], 0, occupant["length_of_stay"]),)
+
+    def count_distinct_nurses(self, r, d, length_of_stay):
+        nurses = set()
+        last_shift = min(self.data.ndays, d + length_of_stay)*self.shifts_per_day
+        for s in range(d*self.shifts_per_day, last_shift):
+            nurses.add(self.nurse[s][r])
+        nurses.discard(-1)
+        return len(nurses)
@@ -1,18 +1,30 @@
 import time
+import random as rd
+import numpy as np
+import src.data.solution as sol
+import src.optimise.nurses as nrs
 
-def greedy_allocation(data, time_limit = 60, time_tolerance = 5):
+def greedy_allocation(data, time_limit = 60, time_tolerance = 5, max_restarts = 10, verbose = False, seed = None):
     """
     PATIENT ASSIGNMENT FIRST
     Iterate through days, then iterate through patients:
     - If mandatory and can be admitted on that day, we admit the patient. All non-essential patients are omitted for now.
-    - Choice of room is the first with space obeying gender at that point in the decision making.
-    - Choice of theater is the one with the most capacity at that point in the decision making.
+    - Choice of room is the first with space obeying gender over the whole stay at that point in the decision making.
+    - Choice of theater is the first with enough capacity at that point in the decision making.
     - Once a patient is admitted they become occupants and are fixed in place.
     - If patient cannot be admitted they are kept in the list until assigned (or we run out of days).
+    - Patients still not admitted are repaired with ejection chains (see greedy_repair).
+    - Only if the repair fails is the solution rebuilt, with the unadmitted patients first
+      (at most max_restarts times or until time_limit - time_tolerance seconds have passed).
+      The attempt with the fewest mandatory patients not admitted is kept, and the patients repaired,
+      the patients not admitted and the seconds taken by each attempt are left in solution["restarts"].
+    - With a seed, patients with the same dates are ordered randomly and the room is a random one with space,
+      so different seeds give different starts (used by the multi-start of the optimiser).
 
     NURSE ASSIGNMENT SECOND
-    Iterate through days, then iterate through nurses:
-    - We now know the workload of each day, which we will try to meet as closely as possible.
+    Iterate through shifts, solving an assignment problem between the nurses working and the rooms:
+    - We now know the workload and skill demand of each room, the nurses are matched to the rooms
+      to keep skill shortfall, excess workload and new nurses for each patient low.
 
     The greedy algorithm will never break the following constraints:
     - RoomGenderMix
@@ -28,63 +40,50 @@ def greedy_allocation(data, time_limit = 60, time_tolerance = 5):
     - UncoveredRoom
     """
     # Creating and sorting a list of mandatory patients (earliest admission date then if same date patient with tighter dates)
-    all_mandatory_patients = [(patient_id,data.patient_dict[patient_id]["possible_admission_days"][0],len(data.patient_dict[patient_id]["possible_admission_days"]))
-                                for patient_id in data.patient_dict 
-                                if data.patient_dict[patient_id]["mandatory"]]
-    all_mandatory_patients = sorted(all_mandatory_patients, key=lambda x: (x[1],x[2]))
-    all_mandatory_patients = [p[0] for p in all_mandatory_patients]
+    rng = rd.Random(seed) if seed is not None else None
+    all_mandatory_patients = np.flatnonzero(data.patient_is_mandatory).tolist()
+    if(rng is not None):
+        rng.shuffle(all_mandatory_patients)
+    all_mandatory_patients = sorted(all_mandatory_patients, key=lambda p: __patient_order(data, p))
     
     # Timing iteration of patient assignment
     time_start = time.time()
+    best_solution = None
+    restarts = []
     
-    while True:
-        # Preallocating solution
-        solution = {"patients": [],
-                    "nurses": [],
-                    "room_allocation": {},
-                    "theater_allocation": {},
-                    "surgeon_allocation": {}}
-
-        # Building room capacity tracking object
-        for d in data.all_days:
-            for r in data.data["rooms"]:
-                solution["room_allocation"][str((d,r["id"]))] = []
-
-        # Theater capacity tracking
-        for d in data.all_days:
-            for t in data.data["operating_theaters"]:
-                solution["theater_allocation"][str((d,t["id"]))] = t["availability"][d]
-
-        # Surgeon capacity tracking
-        for d in data.all_days:
-            for s in data.data["surgeons"]:
-                solution["surgeon_allocation"][str((d,s["id"]))] = s["max_surgery_time"][d]
+    for restart in range(max_restarts):
+        time_restart = time.time()
 
-        # Adding in occupants
-        for o in data.data["occupants"]:
-            for i in range(o["length_of_stay"]):
-                solution["room_allocation"][str((i,o["room_id"]))].append((o["id"],o["gender"],o["age_group"]))
+        # Preallocating solution (occupants are already in their rooms)
+        solution = sol.new_solution(data)
         
         # Iterating over mandatory patients
         admitted_mandatory_patients = []
         for d in data.all_days:
-            for patient_id in all_mandatory_patients:
+            for p in all_mandatory_patients:
                 # Check if already admitted 
-                if(patient_id in admitted_mandatory_patients):
+                if(solution["admission_day"][p] >= 0):
                     continue
                 # If not try allocating
-                [solution,admitted,patient_admission] = greedy_patient_allocation(data,solution,d,patient_id)
-                if(admitted):
-                    solution["patients"].append(patient_admission)
-                    admitted_mandatory_patients.append(patient_id)
-
-        # Checking if any people are not allocated
-        not_allocated = []
-        for patient_id in all_mandatory_patients:
-            if(patient_id not in admitted_mandatory_patients):
-                not_allocated.append((patient_id,data.patient_dict[patient_id]["possible_admission_days"][0],len(data.patient_dict[patient_id]["possible_admission_days"])))
-        not_allocated = sorted(not_allocated, key=lambda x: (x[1],x[2]))
-        not_allocated = [p[0] for p in not_allocated]
+                patient_admission = greedy_patient_allocation(data,solution,d,p,rng)
+                if(patient_admission is not None):
+                    sol.assign_patient(data,solution,p,*patient_admission)
+                    admitted_mandatory_patients.append(p)
+
+        # Repairing the patients which are not allocated
+        not_allocated = sorted([p for p in all_mandatory_patients if solution["admission_day"][p] < 0], key=lambda p: __patient_order(data, p))
+        repaired = [p for p in not_allocated if greedy_repair(data, solution, p)]
+        not_allocated = [p for p in not_allocated if p not in repaired]
+        restarts.append({"restart": restart,
+                         "repaired": len(repaired),
+                         "not_allocated": len(not_allocated),
+                         "seconds": time.time() - time_restart})
+        if(verbose):
+            print("Greedy restart {}: {} patients repaired, {} mandatory patients not allocated ({:.3f} seconds)".format(
+                restart, len(repaired), len(not_allocated), restarts[-1]["seconds"]))
+        if(best_solution is None or len(not_allocated) < restarts[best_restart]["not_allocated"]):
+            best_solution = solution
+            best_restart = restart
 
         # Loop again if not all patients are allocated
         if(len(not_allocated) == 0):
@@ -92,114 +91,146 @@ def greedy_allocation(data, time_limit = 60, time_tolerance = 5):
         if(time_limit-time_tolerance < time.time() - time_start):
             break
         else:
-            all_mandatory_patients = not_allocated + admitted_mandatory_patients
+            all_mandatory_patients = not_allocated + [p for p in all_mandatory_patients if p not in not_allocated]
 
-
-    # Iterating over non-mandatory patients
-    all_non_mandatory_patients = [patient_id for patient_id in data.patient_dict if not data.patient_dict[patient_id]["mandatory"]]
-    for patient_id in all_non_mandatory_patients:
-        solution["patients"].append({"id": patient_id, "admission_day": "none"})
-    
-    # Working out the workload for each (day,shift,room)
-    workload_day_shift_room = {}
-    for d in data.all_days:
-        for r in data.data["rooms"]:
-            occupants = [o[0] for o in solution["room_allocation"][str((d,r["id"]))]]
-            for shift in data.shift_types:
-                total_workload = 0
-                for patient_id in occupants:
-                    # Occupant from day zero
-                    if("a" in patient_id):
-                        for o in data.data["occupants"]:
-                            if(patient_id == o["id"]):
-                                total_workload += o["workload_produced"][data.shift_index_dict[(d,shift)]]
-                                break
-                    # New patient
-                    else:
-                        for p in solution["patients"]:
-                            if(patient_id == p["id"]):
-                                admission_day = p["admission_day"]
-                                total_workload += data.patient_dict[patient_id]["workload_produced"][data.shift_index_dict[(d-admission_day,shift)]]
-                                break
-                workload_day_shift_room[(d,shift,r["id"])] = total_workload
+    # Non-mandatory patients are left unscheduled
+    solution = best_solution
+    solution["restarts"] = restarts
     
-    # Preparing the nurse allocations
-    nurse_allocation = {}
-    for nurse_id in data.nurse_dict:
-        nurse_allocation[nurse_id] = {"id": nurse_id, "assignments": []}
-
-    # Iterating over days, shifts, rooms and nurses to assign nurses
-    for d in data.all_days:
-        for shift in data.shift_types:
-            # Ensuring at most one nurse per room
-            rooms_with_nurse = []
-            # Iterating over nurses
-            for nurse_id in data.nurse_dict:
-                # Check if a nurse can actually do this shift
-                cannot_do_shift = True
-                remaining_load = 0
-                for working_shift in data.nurse_dict[nurse_id]["working_shifts"]:
-                    if(working_shift["day"] == d and working_shift["shift"] == shift):
-                        remaining_load = working_shift["max_load"]
-                        cannot_do_shift = False
-                if(cannot_do_shift):
-                    continue
-                # Working shift so assign workload
-                rooms_assigned_to_nurse = []
-                for r in data.data["rooms"]:
-                    if(r["id"] in rooms_with_nurse):
-                        continue
-                    #elif(remaining_load >= workload_day_shift_room[(d,shift,r["id"])]):
-                    elif(remaining_load >= 0):
-                        rooms_assigned_to_nurse.append(r["id"])
-                        rooms_with_nurse.append(r["id"])
-                        remaining_load -= workload_day_shift_room[(d,shift,r["id"])]
-                # Update the assignments
-                if(len(rooms_assigned_to_nurse) > 0):
-                    nurse_allocation[nurse_id]["assignments"].append({"day": d, 
-                                                                        "shift": shift, 
-                                                                        "rooms": rooms_assigned_to_nurse})
-    
-    # Applying the nurses to the solution
-    for nurse_id in data.nurse_dict:
-        if(len(nurse_allocation[nurse_id]["assignments"]) > 0):
-            solution["nurses"].append(nurse_allocation[nurse_id])
+    # Assigning the nurses of each shift optimally (see src/optimise/nurses.py)
+    nrs.assign_nurses(data, solution)
 
     return solution
     
 
-def greedy_patient_allocation(data,solution,d,patient_id):
-    original_solution = solution
+def greedy_patient_allocation(data,solution,d,p,rng = None):
+    """
+    Returns the first (day, room, theater) admitting patient p on day d without breaking a hard constraint, None if there is none.
+    The room must have space and no one of the other gender on every day of the stay. The solution is not changed.
+    With a random generator rng, the room is picked at random among the rooms with space.
+    """
+    patient = data.patient_list[p]
     # Check if patient can be admitted on this day
-    if(d in data.patient_dict[patient_id]["possible_admission_days"]):
-        # Check if the surgeon has availability on that day
-        surgeon_day_availability = solution["surgeon_allocation"][str((d,data.patient_dict[patient_id]["surgeon_id"]))]
-        if(surgeon_day_availability >= data.patient_dict[patient_id]["surgery_duration"]):
-            for r in data.data["rooms"]:
-                room_day_info = solution["room_allocation"][str((d,r["id"]))]
-                # Check if patient can fit into room
-                if(len(room_day_info) < r["capacity"] and r["id"] in data.patient_dict[patient_id]["possible_rooms"]):
-                    # Check if anyone is in room or check if patient matches gender of room
-                    if(len(room_day_info) == 0 or room_day_info[0][1] == data.patient_dict[patient_id]["gender"]):
-                        for t in data.data["operating_theaters"]:
-                            # Checking if the theater has enough capacity to perform surgery
-                            if(solution["theater_allocation"][str((d,t["id"]))] >= data.patient_dict[patient_id]["surgery_duration"]):
-                                # ADMIT PATIENT
-                                patient_admission = {"id": patient_id}
-                                # Add day
-                                patient_admission["admission_day"] = d
-                                # Add room
-                                patient_admission["room"] = r["id"]
-                                for i in range(data.patient_dict[patient_id]["length_of_stay"]):
-                                    if(d+i < data.ndays):
-                                        solution["room_allocation"][str((d+i,r["id"]))].append((patient_id,
-                                                                                data.patient_dict[patient_id]["gender"],
-                                                                                data.patient_dict[patient_id]["age_group"]))
-                                # Add theater
-                                solution["theater_allocation"][str((d,t["id"]))] -= data.patient_dict[patient_id]["surgery_duration"]
-                                patient_admission["operating_theater"] = t["id"]
-                                # Update surgeons hours
-                                solution["surgeon_allocation"][str((d,data.patient_dict[patient_id]["surgeon_id"]))] -= data.patient_dict[patient_id]["surgery_duration"]
-                                # Return the admission details
-                                return solution,True,patient_admission
-    return original_solution,False,{}
+    if(not data.patient_day_admissible[p,d]):
+        return None
+    # Check if the surgeon has availability on that day
+    if(solution["surgeon_allocation"][d,patient["surgeon"]] < patient["surgery_duration"]):
+        return None
+    # Checking if a theater has enough capacity to perform surgery
+    theaters = np.flatnonzero(solution["theater_allocation"][d] >= patient["surgery_duration"])
+    if(len(theaters) == 0):
+        return None
+    # Check if patient can fit into a room for the whole stay, with no one of the other gender
+    stay_end = min(data.ndays, d + patient["length_of_stay"])
+    rooms = np.flatnonzero(data.patient_room_compatible[p] &
+                           (solution["room_allocation"][d:stay_end] < data.room_capacity).all(axis = 0) &
+                           (solution["gender_allocation"][d:stay_end,:,1-patient["gender_index"]] == 0).all(axis = 0))
+    if(len(rooms) == 0):
+        return None
+    # ADMIT PATIENT
+    room = rooms[0] if rng is None else rng.choice(rooms)
+    return (d, int(room), int(theaters[0]))
+
+
+def greedy_first_admission(data,solution,p):
+    """
+    Returns the first admission of patient p over its possible admission days, None if there is none.
+    """
+    for d in data.patient_list[p]["possible_admission_days"]:
+        patient_admission = greedy_patient_allocation(data,solution,d,p)
+        if(patient_admission is not None):
+            return patient_admission
+    return None
+
+
+def greedy_repair(data, solution, p, depth = 2, fixed = None):
+    """
+    Tries to admit patient p with an ejection chain: the admitted patients stopping p from using a room on one of its days
+    (sharing the room, or the surgeon/theater time p needs) are ejected so p fits, and are then admitted elsewhere
+    themselves (ejecting others, up to depth ejections along the chain).
+    Patients in fixed are never ejected. Returns whether p was admitted, the solution is unchanged if not.
+    """
+    patient_admission = greedy_first_admission(data, solution, p)
+    if(patient_admission is not None):
+        sol.assign_patient(data, solution, p, *patient_admission)
+        return True
+    if(depth == 0):
+        return False
+    fixed = (fixed or set()) | {p}
+    for ejected in __ejection_sets(data, solution, p, fixed):
+        snapshot = sol.copy_solution(solution)
+        for q in ejected:
+            sol.unassign_patient(data, solution, q)
+        patient_admission = greedy_first_admission(data, solution, p)
+        if(patient_admission is not None):
+            sol.assign_patient(data, solution, p, *patient_admission)
+            if(all(greedy_repair(data, solution, q, depth - 1, fixed) for q in ejected)):
+                return True
+        sol.restore_solution(solution, snapshot)
+    return False
+
+
+# Number of ejection sets tried for a patient at each step of a chain
+ejection_sets = 30
+
+def __ejection_sets(data, solution, p, fixed):
+    """
+    For every possible (day, room) of patient p, the admitted patients to eject so p fits:
+    the patients sharing the room during the stay and, if short of time, patients of the same surgeon/theater that day.
+    (day, room) pairs needing to eject a fixed patient or blocked by occupants are skipped. Smallest sets first.
+    """
+    patient = data.patient_list[p]
+    duration = patient["surgery_duration"]
+    admitted = np.flatnonzero(solution["admission_day"] >= 0)
+    sets = []
+    for d in patient["possible_admission_days"]:
+        stay_end = min(data.ndays, d + patient["length_of_stay"])
+        same_day = [q for q in admitted.tolist() if solution["admission_day"][q] == d and q not in fixed]
+
+        # Freeing the surgeon's time (longest surgeries first)
+        surgeon_set = []
+        surgeon_time = solution["surgeon_allocation"][d,patient["surgeon"]]
+        for q in sorted([q for q in same_day if data.patient_list[q]["surgeon"] == patient["surgeon"]],
+                        key = lambda q: -data.patient_list[q]["surgery_duration"]):
+            if(surgeon_time >= duration):
+                break
+            surgeon_set.append(q)
+            surgeon_time += data.patient_list[q]["surgery_duration"]
+        if(surgeon_time < duration):
+            continue
+
+        # Freeing the theater with the most time left
+        t = int(np.argmax(solution["theater_allocation"][d]))
+        theater_set = []
+        theater_time = solution["theater_allocation"][d,t] + sum(data.patient_list[q]["surgery_duration"]
+                                                                for q in surgeon_set if solution["theater"][q] == t)
+        for q in sorted([q for q in same_day if solution["theater"][q] == t and q not in surgeon_set],
+                        key = lambda q: -data.patient_list[q]["surgery_duration"]):
+            if(theater_time >= duration):
+                break
+            theater_set.append(q)
+            theater_time += data.patient_list[q]["surgery_duration"]
+        if(theater_time < duration):
+            continue
+
+        # Emptying a room of patients over the stay
+        for r in patient["room_options"]:
+            occupants = [o for o in data.occupant_list if o["room"] == r and o["length_of_stay"] > d]
+            if(len(occupants) >= data.room_capacity[r] or any(o["gender_index"] != patient["gender_index"] for o in occupants)):
+                continue
+            room_set = [q for q in admitted.tolist() if solution["room"][q] == r and
+                        solution["admission_day"][q] < stay_end and
+                        solution["admission_day"][q] + data.patient_list[q]["length_of_stay"] > d]
+            if(any(q in fixed for q in room_set)):
+                continue
+            ejected = list(dict.fromkeys(room_set + surgeon_set + theater_set))
+            if(len(ejected) > 0):
+                sets.append(ejected)
+    sets.sort(key = len)
+    return sets[:ejection_sets]
+
+
+# Patient ordering: earliest admission date then if same date patient with tighter dates
+def __patient_order(data, p):
+    days = data.patient_list[p]["possible_admission_days"]
+    return (days[0], len(days))
@@ -2,53 +2,112 @@
 this module contains all of the low level heuristic moves.
 """
 
+import itertools
 import random as rd
+import numpy as np
 import src.optimise.greedy as grd
+import src.data.solution as sol
+import src.optimise.nurses as nrs
 
 """
-Function to ensure the "room_allocation", "theater_allocation" and "surgeon_allocation" are correct.
+Functions to ensure the "room_allocation", "gender_allocation", "theater_allocation" and "surgeon_allocation" are correct.
 """
 
 # Update all allocations
 def __update_allocations__(data,solution):
-    # Initialising
-    for d in data.all_days:
-        # Room allocations
-        for r in data.data["rooms"]:
-            solution["room_allocation"][str((d,r["id"]))] = []
-        # Theater allocations
-        for t in data.data["operating_theaters"]:
-            solution["theater_allocation"][str((d,t["id"]))] = t["availability"][d]
-        # Surgeon allocations
-        for s in data.data["surgeons"]:
-            solution["surgeon_allocation"][str((d,s["id"]))] = s["max_surgery_time"][d]
-    
-    # Adding existing occupants
-    for o in data.data["occupants"]:
-        for i in range(o["length_of_stay"]):
-            solution["room_allocation"][str((i,o["room_id"]))].append((o["id"],o["gender"],o["age_group"]))
-
-    # Adding patients
-    assigned_patients = [patient for patient in solution["patients"] if patient["admission_day"] != "none"]
-    for p in assigned_patients:
-        patient_information = data.patient_dict[p["id"]]
-        i0 = p["admission_day"]
-        # Update room allocation
-        for i in range(patient_information["length_of_stay"]):
-            ix=i0+i
-            if ix in data.all_days:
-                solution["room_allocation"][str((i0+i,p["room"]))].append((p["id"],
-                                                                           patient_information["gender"],
-                                                                           patient_information["age_group"])
-                                                                          )
-            else:
-                break
-        # Update theater allocations
-        solution["theater_allocation"][str((i0,t["id"]))] -= patient_information["surgery_duration"]
-        # Update surgeon allocations
-        solution["surgeon_allocation"][str((i0,patient_information["surgeon_id"]))] -= patient_information["surgery_duration"]
+    return sol.update_allocations(data,solution)
+
+# Check the allocations match a full rebuild (debugging the incremental updates made by the moves)
+def __check_allocations__(data,solution):
+    sol.check_allocations(data,solution)
+
+"""
+Functions to record what a move touched so the evaluator only needs to rescore the affected cells.
+Patient changes also update the allocations for the stay and surgery that moved, rather than rebuilding them.
+"""
+
+# Add a change to the solution's record
+def __record_change(solution, change):
+    solution.setdefault("changes", []).append(change)
+
+# Apply a patient change to the solution and allocations and record it
+def __apply_patient_change(data, solution, p, new_assignment):
+    old_assignment = sol.patient_assignment(solution, p)
+    if(old_assignment is not None):
+        sol.unassign_patient(data, solution, p)
+    if(new_assignment is not None):
+        sol.assign_patient(data, solution, p, *new_assignment)
+    __record_change(solution, ("patient", p, old_assignment, new_assignment))
+
+# Change the nurse covering a room in a shift and record it
+def __apply_nurse_change(data, solution, s, r, n):
+    old_nurse = int(solution["nurse"][s,r])
+    sol.set_nurse(data, solution, s, r, n)
+    __record_change(solution, ("nurse", s, r, old_nurse, n))
+
+# Patients currently (not) scheduled
+def __assigned_patients(solution):
+    return np.flatnonzero(solution["admission_day"] >= 0).tolist()
+
+def __unassigned_patients(solution):
+    return np.flatnonzero(solution["admission_day"] < 0).tolist()
 
-    # Return solution
+"""
+Functions to only propose changes keeping the hard constraints, checked on the allocations before the solution is scored.
+Every proposal turned down is counted in solution["rejected"] (see the move telemetry).
+"""
+
+# Random proposals tried by insert_patient before giving up
+proposal_attempts = 10
+
+# Whether patient p can be admitted on day d in room r and theater t without breaking a hard constraint
+# (for a scheduled patient, current is its assignment, whose stay and surgery do not count against it)
+def __hard_feasible(data, solution, p, d, r, t, current = None):
+    patient = data.patient_list[p]
+    duration = patient["surgery_duration"]
+    if(not data.patient_day_admissible[p,d] or not data.patient_room_compatible[p,r]):
+        return False
+    d0, r0, t0 = current if current is not None else (-1, -1, -1)
+    if(solution["surgeon_allocation"][d,patient["surgeon"]] + duration*(d0 == d) < duration or
+       solution["theater_allocation"][d,t] + duration*(d0 == d and t0 == t) < duration):
+        return False
+    stay_end = min(data.ndays, d + patient["length_of_stay"])
+    occupancy = solution["room_allocation"][d:stay_end,r]
+    if(r0 == r):
+        # Days the patient already takes a bed in the room
+        days = np.arange(d, stay_end)
+        occupancy = occupancy - ((days >= d0) & (days < d0 + patient["length_of_stay"]))
+    if((occupancy >= data.room_capacity[r]).any()):
+        return False
+    if((solution["gender_allocation"][d:stay_end,r,1-patient["gender_index"]] > 0).any()):
+        return False
+    return bool((solution["nurse"][d*data.shifts_per_day:stay_end*data.shifts_per_day,r] >= 0).all())
+
+# Count proposals turned down before evaluation
+def __reject_proposals(solution, count = 1):
+    solution["rejected"] = solution.get("rejected", 0) + count
+
+# First hard-feasible assignment of patient p among the options (in order), None if there is none
+def __first_feasible(data, solution, p, options, current = None):
+    for i, option in enumerate(options):
+        if(__hard_feasible(data, solution, p, *option, current = current)):
+            __reject_proposals(solution, i)
+            return option
+    __reject_proposals(solution, len(options))
+    return None
+
+# Whether an option of greedy_patient_allocation (which does not look at the nurses) keeps the hard constraints, counting it if not
+def __covered_option(data, solution, p, option):
+    if(__hard_feasible(data, solution, p, *option)):
+        return True
+    __reject_proposals(solution)
+    return False
+
+# Move the scheduled patient p to the first hard-feasible option (the solution is only changed if there is one)
+def __move_to_feasible(data, solution, p, options):
+    option = __first_feasible(data, solution, p, options, sol.patient_assignment(solution, p))
+    if(option is not None):
+        __apply_patient_change(data, solution, p, option)
     return solution
 
 """
@@ -57,19 +116,19 @@ Functions to help find a surgeon/room/theater for a non-mandatory patient
 
 def __find_surgeon(data, solution):
     """
-    Find a (Random) available surgeon - return the surgeon id (s), which day they are available (d) and for how long (T_s)
+    Find a (Random) available surgeon - return the surgeon index (s), which day they are available (d) and for how long (T_s)
     
     """
-    surgeons = rd.sample(data.data['surgeons'],len(data.data['surgeons']))
+    surgeons = rd.sample(range(len(data.surgeon_ids)),len(data.surgeon_ids))
     days = rd.sample(data.all_days,len(data.all_days))
-    surgeon = surgeons[0]['id']
+    surgeon = surgeons[0]
     day = 0
     T_s = 0
     for s in surgeons:
         for d in days:
-            time = solution['surgeon_allocation'][str((d,s['id']))] # remainin time
+            time = solution['surgeon_allocation'][d,s] # remainin time
             if time>0:
-                surgeon = s['id']
+                surgeon = s
                 day = d
                 T_s = time
                 break
@@ -78,62 +137,63 @@ def __find_surgeon(data, solution):
 
 def __find_theater(data, solution, d, T_s):
     """
-    Find an available theater for a specific day (d) for a given length of time (T_s) - return the theater id (t)
+    Find an available theater for a specific day (d) for a given length of time (T_s) - return the theater index (t)
     """
-    theaters = rd.sample(data.data['operating_theaters'],len(data.data['operating_theaters']))
-    theater = theaters[0]['id']
+    theaters = rd.sample(range(len(data.theater_ids)),len(data.theater_ids))
+    theater = theaters[0]
     for t in theaters:
-        if solution['theater_allocation'][str((d,t['id']))]>=T_s:
-            theater = t['id']
+        if solution['theater_allocation'][d,t]>=T_s:
+            theater = t
             break
 
     return theater
 
+def __room_gender(solution, d, r):
+    """
+    Gender index of the people in room (r) on day (d), -1 if the room is empty
+    """
+    genders = solution["gender_allocation"][d,r]
+    if genders[0]==0 and genders[1]==0:
+        return -1
+    return int(np.argmax(genders))
+
 def __find_room(data, solution, d):
     """
-    Find a room which is availabe on day (d), return room id (r), gender (g), how long its avail for (T_r)
+    Find a room which is availabe on day (d), return room index (r), gender index (g), how long its avail for (T_r)
     """
-    rooms = rd.sample(data.data['rooms'],len(data.data['rooms']))
+    rooms = rd.sample(range(len(data.room_ids)),len(data.room_ids))
     room = rooms[0]
-    gender = rd.choices(['A','B'])[0]
+    gender = rd.choice([0,1])
     days_avail = [d]
     for r in rooms:
         # is this room avail on this day
-        T_r = min(1,r['capacity'] - len(solution["room_allocation"][str((d,r["id"]))]))
+        T_r = min(1,data.room_capacity[r] - solution["room_allocation"][d,r])
         if T_r>0:
             # choose this room
             room = r
             # what is current gender
-            if len(solution["room_allocation"][str((d,r["id"]))])>0:
-                gender = solution["room_allocation"][str((d,r["id"]))][0][1]
-            else:
-                gender = '-'
-            # days left in horizon
-            remaining_days = [i for i in data.all_days if data.all_days[i]>d]
-            # how long is it avail at this gender
+            gender = __room_gender(solution, d, r)
+            # how long is it avail at this gender (days left in horizon)
             days_avail = [d]
-            for dx in remaining_days:
+            for dx in range(d+1,data.ndays):
                 # is there capacity for another day?
-                more_days = min(1,r['capacity'] - len(solution["room_allocation"][str((dx,r["id"]))]))
+                more_days = min(1,data.room_capacity[r] - solution["room_allocation"][dx,r])
                 if more_days>0:
                     # what is gender on this day
-                    if len(solution["room_allocation"][str((dx,r["id"]))])>0:
-                        gx = solution["room_allocation"][str((dx,r["id"]))][0][1]
-                    else:
-                        gx = '-'
+                    gx = __room_gender(solution, dx, r)
                     # is the gender on this day compatible
-                    if gx=='-' or gx==gender:
+                    if gx==-1 or gx==gender:
                         days_avail.append(dx)
-                        if gx != '-' and gender == '-':
+                        if gx != -1 and gender == -1:
                             gender = gx
                     else:
                         break
                 else:
                     break
             break
-    if gender == '-':
-        gender = rd.choices(['A','B'])[0]
-    return room['id'], gender, days_avail
+    if gender == -1:
+        gender = rd.choice([0,1])
+    return room, gender, days_avail
 
 def __find_patient(data, patients, s, d, T_s, t, r, g, T_r):
     """
@@ -146,41 +206,31 @@ def __find_patient(data, patients, s, d, T_s, t, r, g, T_r):
     g: gender of room
     T_r: how many days the room is avail for
     """
-    found = False
     patient_shuffle = rd.sample(patients,len(patients))
     for p in patient_shuffle:
-        if data.patient_dict[p]['surgeon_id']==s:
-            if d in data.patient_dict[p]['possible_admission_days']:
-                if data.patient_dict[p]['surgery_duration']<=T_s:
-                    if t in data.patient_dict[p]['possible_theaters']:
-                        if r in data.patient_dict[p]['possible_rooms']:
-                            if data.patient_dict[p]['gender']==g:
-                                if data.patient_dict[p]['length_of_stay']<=len(T_r) or T_r[-1]==data.all_days[-1]:
-                                    new_patient = p
-                                    found = True
-                                    break
-
-    if found:
-        patient_admission = {"id": p,
-                             "admission_day" : d,
-                             "room" : r,
-                             "operating_theater" : t}
-    else:
-        patient_admission = {}
-
-    return patient_admission, found
+        patient = data.patient_list[p]
+        if patient['surgeon']==s:
+            if data.patient_day_admissible[p,d]:
+                if patient['surgery_duration']<=T_s:
+                    if t in patient['theater_options']:
+                        if data.patient_room_compatible[p,r]:
+                            if patient['gender_index']==g:
+                                if patient['length_of_stay']<=len(T_r) or T_r[-1]==data.all_days[-1]:
+                                    return p, True
+
+    return None, False
 
 """
 PATIENT THEMED MOVES
 """
 
-# Insert a non-mandatory patient
+# Insert an unscheduled patient
 def insert_patient(data,solution):
     """
-    This operator takes a solution and tries to insert a single non-mandatory patient
+    This operator takes a solution and tries to insert a single unscheduled patient (mandatory or not)
     """
     # Creating a list of unassigned patients
-    non_assigned_patients = [patient["id"] for patient in solution["patients"] if patient["admission_day"] == "none"]
+    non_assigned_patients = __unassigned_patients(solution)
 
     # If cannot remove patient then return
     if(len(non_assigned_patients) == 0):
@@ -188,24 +238,15 @@ def insert_patient(data,solution):
     
     # Selecting a patient to insert
     patient_to_insert = rd.choices(non_assigned_patients)[0]
-    patient_information = data.patient_dict[patient_to_insert]
-
-    # Selecting random features for solution
-    new_solution_entry = {"id": patient_to_insert,
-                            "admission_day": rd.choices(patient_information["possible_admission_days"])[0],
-                            "room": rd.choices(patient_information["possible_rooms"])[0],
-                            "operating_theater": rd.choices(patient_information["possible_theaters"])[0]}
-    
-    # Creating new solution
-    new_patients = []
-    for current_patient in solution["patients"]:
-        if(current_patient["id"] != patient_to_insert):
-            new_patients.append(current_patient)
-        else:
-            new_patients.append(new_solution_entry)
-    solution["patients"] = new_patients
-
-    solution = __update_allocations__(data,solution)
+    patient_information = data.patient_list[patient_to_insert]
+
+    # Selecting random features for solution, keeping the first proposal that breaks no hard constraint
+    proposals = [(rd.choices(patient_information["possible_admission_days"])[0],
+                  rd.choices(patient_information["room_options"])[0],
+                  rd.choices(patient_information["theater_options"])[0]) for i in range(proposal_attempts)]
+    new_assignment = __first_feasible(data, solution, patient_to_insert, proposals)
+    if(new_assignment is not None):
+        __apply_patient_change(data, solution, patient_to_insert, new_assignment)
     
     # Return updated solution
     return solution
@@ -217,35 +258,22 @@ def insert_patient_empty_room(data,solution):
     This operator takes a solution and tries to insert a single non-mandatory patient into an entry room
     """
     # Creating a list of unassigned patients
-    non_assigned_patients = [[patient["id"],sum(data.patient_dict[patient["id"]]["workload_produced"])] for patient in solution["patients"] if patient["admission_day"] == "none"]
+    non_assigned_patients = __unassigned_patients(solution)
 
     # If cannot remove patient then return
     if(len(non_assigned_patients) == 0):
         return solution
 
     # Selecting a patient to insert - least workload
-    patient_to_insert = min(non_assigned_patients, key=lambda x: x[1])[0]
+    patient_to_insert = min(non_assigned_patients, key=lambda p: sum(data.patient_list[p]["workload_produced"]))
 
     # Find a day/room/theatre that works for this patient
-    looking = True
-    d=0
-    while looking and d<data.ndays:
+    for d in range(data.ndays):
         # try allocating
-        [solution,admitted,patient_admission] = grd.greedy_patient_allocation(data,solution,d,patient_to_insert)
-        if(admitted):
-            # Creating new solution
-            new_patients = []
-            for current_patient in solution["patients"]:
-                if(current_patient["id"] != patient_to_insert):
-                    new_patients.append(current_patient)
-                else:
-                    new_patients.append(patient_admission)
-            solution["patients"] = new_patients
-            looking = False
-        else:
-            d+=1
-
-    solution = __update_allocations__(data,solution)
+        patient_admission = grd.greedy_patient_allocation(data,solution,d,patient_to_insert)
+        if(patient_admission is not None and __covered_option(data, solution, patient_to_insert, patient_admission)):
+            __apply_patient_change(data, solution, patient_to_insert, patient_admission)
+            break
             
     # Return updated solution
     return solution
@@ -257,7 +285,7 @@ def insert_patient_to_available_surgeon(data,solution):
     Also finds a compatitble theater and room
     """
     # Creating a list of unassigned patients
-    non_assigned_patients = [patient["id"] for patient in solution["patients"] if patient["admission_day"] == "none"]
+    non_assigned_patients = __unassigned_patients(solution)
 
     # If cannot remove patient then return
     if(len(non_assigned_patients) == 0):
@@ -269,17 +297,12 @@ def insert_patient_to_available_surgeon(data,solution):
     r, g, T_r = __find_room(data, solution, d)
     patient_to_insert, found = __find_patient(data, non_assigned_patients, s, d, T_s, t, r, g, T_r)
 
-    # Creating new solution
-    if found:
-        new_patients = []
-        for current_patient in solution["patients"]:
-            if(current_patient["id"] != patient_to_insert['id']):
-                new_patients.append(current_patient)
-            else:
-                new_patients.append(patient_to_insert)
-        solution["patients"] = new_patients
-        solution = __update_allocations__(data,solution)
+    # Updating the solution (the room may not be free for the whole stay, nor the theater for the surgery)
+    if found and __hard_feasible(data, solution, patient_to_insert, d, r, t):
+        __apply_patient_change(data, solution, patient_to_insert, (d, r, t))
     else:
+        if found:
+            __reject_proposals(solution)
         solution = insert_patient(data,solution)
 
     return solution
@@ -290,8 +313,7 @@ def remove_patient(data,solution):
     This operator takes a solution and removes a single non-mandatory patient
     """
     # Creating a list of non-mandatory patients
-    assigned_patients = [patient["id"] for patient in solution["patients"] if patient["admission_day"] != "none"]
-    assigned_non_mandatory_patients = list(set(data.all_non_mandatory_patients) & set(assigned_patients))
+    assigned_non_mandatory_patients = np.flatnonzero((solution["admission_day"] >= 0) & ~data.patient_is_mandatory).tolist()
 
     # If cannot remove patient then return
     if(len(assigned_non_mandatory_patients) == 0):
@@ -301,13 +323,7 @@ def remove_patient(data,solution):
     patient_to_remove = rd.choices(assigned_non_mandatory_patients)[0]
 
     # Removing patient
-    new_patients = []
-    for current_patient in solution["patients"]:
-        if(current_patient["id"] != patient_to_remove):
-            new_patients.append(current_patient)
-    solution["patients"] = new_patients
-
-    solution = __update_allocations__(data,solution)
+    __apply_patient_change(data, solution, patient_to_remove, None)
     
     # Return modified solution
     return solution
@@ -318,7 +334,7 @@ def remove_patient_any(data,solution):
     This operator takes a solution and removes a single non-mandatory patient
     """
     # Creating a list of non-mandatory patients
-    assigned_patients = [patient["id"] for patient in solution["patients"] if patient["admission_day"] != "none"]
+    assigned_patients = __assigned_patients(solution)
 
     # If cannot remove patient then return
     if(len(assigned_patients) == 0):
@@ -328,13 +344,7 @@ def remove_patient_any(data,solution):
     patient_to_remove = rd.choices(assigned_patients)[0]
 
     # Removing patient
-    new_patients = []
-    for current_patient in solution["patients"]:
-        if(current_patient["id"] != patient_to_remove):
-            new_patients.append(current_patient)
-    solution["patients"] = new_patients
-
-    solution = __update_allocations__(data,solution)
+    __apply_patient_change(data, solution, patient_to_remove, None)
     
     # Return modified solution
     return solution
@@ -343,7 +353,6 @@ def remove_patient_any(data,solution):
 def remove_then_insert_patient(data,solution):
     solution = remove_patient(data,solution)
     solution = insert_patient(data,solution)
-    solution = __update_allocations__(data,solution)
     return solution
 
 
@@ -351,13 +360,12 @@ def remove_then_insert_patient(data,solution):
 def remove_then_insert_patient_any(data,solution):
     solution = remove_patient_any(data,solution)
     solution = insert_patient(data,solution)
-    solution = __update_allocations__(data,solution)    
     return solution
 
 # Change patient room
 def change_patient_room(data,solution):
     # Get all of the assigned patients
-    assigned_patients = [patient["id"] for patient in solution["patients"] if patient["admission_day"] != "none"]
+    assigned_patients = __assigned_patients(solution)
     if(len(assigned_patients) == 0):
         return solution
     # Selecting a patient to alter
@@ -370,7 +378,7 @@ def change_patient_room(data,solution):
 # Change patient admission day
 def change_patient_admission(data,solution):
     # Get all of the assigned patients
-    assigned_patients = [patient["id"] for patient in solution["patients"] if patient["admission_day"] != "none"]
+    assigned_patients = __assigned_patients(solution)
     if(len(assigned_patients) == 0):
         return solution
     # Selecting a patient to alter
@@ -383,7 +391,7 @@ def change_patient_admission(data,solution):
 # Change patient theater
 def change_patient_theater(data,solution):
     # Get all of the assigned patients
-    assigned_patients = [patient["id"] for patient in solution["patients"] if patient["admission_day"] != "none"]
+    assigned_patients = __assigned_patients(solution)
     if(len(assigned_patients) == 0):
         return solution
     # Selecting a patient to alter
@@ -395,7 +403,7 @@ def change_patient_theater(data,solution):
 # Compound movements
 def change_patient_compound1(data,solution):
     # Get all of the assigned patients
-    assigned_patients = [patient["id"] for patient in solution["patients"] if patient["admission_day"] != "none"]
+    assigned_patients = __assigned_patients(solution)
     if(len(assigned_patients) == 0):
         return solution
     # Selecting a patient to alter
@@ -409,7 +417,7 @@ def change_patient_compound1(data,solution):
 
 def change_patient_compound2(data,solution):
     # Get all of the assigned patients
-    assigned_patients = [patient["id"] for patient in solution["patients"] if patient["admission_day"] != "none"]
+    assigned_patients = __assigned_patients(solution)
     if(len(assigned_patients) == 0):
         return solution
     # Selecting a patient to alter
@@ -422,7 +430,7 @@ def change_patient_compound2(data,solution):
 
 def change_patient_compound3(data,solution):
     # Get all of the assigned patients
-    assigned_patients = [patient["id"] for patient in solution["patients"] if patient["admission_day"] != "none"]
+    assigned_patients = __assigned_patients(solution)
     if(len(assigned_patients) == 0):
         return solution
     # Selecting a patient to alter
@@ -433,162 +441,359 @@ def change_patient_compound3(data,solution):
     return solution
 
 
-# Changes room for a patient
+# Changes room for a patient (to a random room keeping the hard constraints)
 def __change_patient_room(data,solution,patient_to_move):
-    # Iterate through patients until find entry
-    for p in solution["patients"]:
-        if(p["id"] == patient_to_move):
-            patient_rooms = data.patient_dict[patient_to_move]["possible_rooms"]
-            current_room = p["room"]
-            room_options = list(set(patient_rooms) - set([current_room]))
-            if(len(room_options) != 0):
-                new_room = rd.choices(room_options)[0]
-                p["room"] = new_room
-            break
-
-    solution = __update_allocations__(data,solution)
-        
+    d, current_room, t = sol.patient_assignment(solution, patient_to_move)
+    room_options = [r for r in data.patient_list[patient_to_move]["room_options"] if r != current_room]
+    options = [(d, r, t) for r in rd.sample(room_options, len(room_options))]
     # Return modifed solution
-    return solution
+    return __move_to_feasible(data, solution, patient_to_move, options)
 
 
 def __change_patient_admission(data,solution,patient_to_move):
-    # Iterate through patients until find entry
-    for p in solution["patients"]:
-        if(p["id"] == patient_to_move):
-            patient_days = data.patient_dict[patient_to_move]["possible_admission_days"]
-            current_day= p["admission_day"]
-            day_options = list(set(patient_days) - set([current_day]))
-            if(len(day_options) != 0):
-                new_day = rd.choices(day_options)[0]
-                p["admission_day"] = new_day
-            break
+    current_day, r, t = sol.patient_assignment(solution, patient_to_move)
+    day_options = [d for d in data.patient_list[patient_to_move]["possible_admission_days"] if d != current_day]
+    options = [(d, r, t) for d in rd.sample(day_options, len(day_options))]
+    # Return modifed solution
+    return __move_to_feasible(data, solution, patient_to_move, options)
 
-    solution = __update_allocations__(data,solution)
-        
+
+def __change_patient_theater(data,solution,patient_to_move):
+    d, r, current_theater = sol.patient_assignment(solution, patient_to_move)
+    theater_options = [t for t in data.patient_list[patient_to_move]["theater_options"] if t != current_theater]
+    options = [(d, r, t) for t in rd.sample(theater_options, len(theater_options))]
     # Return modifed solution
+    return __move_to_feasible(data, solution, patient_to_move, options)
+
+
+"""
+BEST OF NEIGHBOURHOOD MOVES
+Every room, admission day or theater of a patient is scored at once and the best one is applied.
+"""
+
+# Move a patient to its best room
+def best_patient_room(data,solution):
+    return __best_patient_option(data, solution, "room")
+
+
+# Move a patient to its best admission day
+def best_patient_admission(data,solution):
+    return __best_patient_option(data, solution, "day")
+
+
+# Move a patient to its best theater
+def best_patient_theater(data,solution):
+    return __best_patient_option(data, solution, "theater")
+
+
+def __best_patient_option(data, solution, kind):
+    # Selecting a patient to alter
+    assigned_patients = __assigned_patients(solution)
+    if(len(assigned_patients) == 0):
+        return solution
+    p = rd.choice(assigned_patients)
+    d, r, t = sol.patient_assignment(solution, p)
+    patient = data.patient_list[p]
+    # Every option of the patient, the others parts of its assignment staying the same
+    if(kind == "room"):
+        options = np.array([(d, room, t) for room in patient["room_options"]])
+    elif(kind == "day"):
+        options = np.array([(day, r, t) for day in patient["possible_admission_days"]])
+    else:
+        options = np.array([(d, r, theater) for theater in patient["theater_options"]])
+    # Scoring the options with the patient taken out of the solution
+    sol.unassign_patient(data, solution, p)
+    costs = __option_costs(data, solution, p, options)
+    sol.assign_patient(data, solution, p, d, r, t)
+    best = int(np.argmin(costs))
+    if(np.isfinite(costs[best]) and tuple(options[best]) != (d, r, t)):
+        __apply_patient_change(data, solution, p, tuple(int(x) for x in options[best]))
+    # Return modified solution
     return solution
 
 
-def __change_patient_theater(data,solution,patient_to_move):
-    # Iterate through patients until find entry
-    for p in solution["patients"]:
-        if(p["id"] == patient_to_move):
-            patient_theaters = data.patient_dict[patient_to_move]["possible_theaters"]
-            current_theater = p["operating_theater"]
-            theater_options = list(set(patient_theaters) - set([current_theater]))
-            if(len(theater_options) != 0):
-                new_theater = rd.choices(theater_options)[0]
-                p["operating_theater"] = new_theater
-            break
+def __option_costs(data, solution, p, options):
+    """
+    Estimated change in weighted cost of admitting the (unscheduled) patient p with each option (day, room, theater).
+    Options breaking a hard constraint (admission day, room compatibility, capacity, gender, theater or surgeon time,
+    uncovered room) cost inf. The skill level, continuity of care and age mix are those of the patient's room
+    and the excess workload that of the nurses caring for it, so other patients' continuity of care is left out.
+    """
+    patient = data.patient_list[p]
+    weights = data.weights
+    spd = data.shifts_per_day
+    d, r, t = options[:,0], options[:,1], options[:,2]
+    u = patient["surgeon"]
+    duration = patient["surgery_duration"]
+
+    # Days [option, day of stay] and shifts [option, shift of stay] within the scheduling period
+    days = d[:,None] + np.arange(patient["length_of_stay"])[None,:]
+    in_days = days < data.ndays
+    days = np.minimum(days, data.ndays - 1)
+    shifts = d[:,None]*spd + np.arange(patient["length_of_stay"]*spd)[None,:]
+    in_shifts = shifts < data.nshifts
+    shifts = np.minimum(shifts, data.nshifts - 1)
+    offsets = np.minimum(np.arange(patient["length_of_stay"]*spd), len(patient["skill_level_required"]) - 1)
+
+    # Hard constraints
+    feasible = (data.patient_day_admissible[p,d] & data.patient_room_compatible[p,r] &
+                (solution["theater_allocation"][d,t] >= duration) &
+                (solution["surgeon_allocation"][d,u] >= duration) &
+                ((solution["room_allocation"][days,r[:,None]] < data.room_capacity[r][:,None]) | ~in_days).all(axis = 1) &
+                ((solution["gender_allocation"][days,r[:,None],1-patient["gender_index"]] == 0) | ~in_days).all(axis = 1))
+    nurses = solution["nurse"][shifts,r[:,None]]
+    feasible &= ((nurses >= 0) | ~in_shifts).all(axis = 1)
+    caring = np.maximum(nurses, 0)
+
+    # Delay, opening a theater and surgeon transfers
+    cost = weights["patient_delay"]*np.maximum(0, d - patient["surgery_release_day"]).astype(float)
+    cost += weights["open_operating_theater"]*(solution["theater_allocation"][d,t] == data.theater_availability[d,t])
+    operated = (solution["admission_day"] >= 0) & (data.patient_surgeon == u)
+    surgeon_theaters = np.zeros((data.ndays, len(data.theater_ids)), dtype=bool)
+    surgeon_theaters[solution["admission_day"][operated],solution["theater"][operated]] = True
+    cost += weights["surgeon_transfer"]*(surgeon_theaters[d].any(axis = 1) & ~surgeon_theaters[d,t])
+
+    # Skill level of the nurses caring for the patient and distinct nurses (continuity of care)
+    required = np.array(patient["skill_level_required"])[offsets]
+    shortfall = data.skill_shortfall[data.nurse_skill[caring],required[None,:]]
+    cost += weights["room_nurse_skill"]*(shortfall*in_shifts).sum(axis = 1)
+    ordered = np.sort(np.where(in_shifts, caring, -1), axis = 1)
+    distinct = (np.diff(ordered, axis = 1) != 0).sum(axis = 1) + (ordered[:,0] >= 0)
+    cost += weights["continuity_of_care"]*distinct
+
+    # Excess workload added to the nurses caring for the patient
+    workload = sol.room_shift_demand(data, solution)[0]
+    nurse_load = np.zeros((data.nshifts, len(data.nurse_ids) + 1))
+    np.add.at(nurse_load, (np.arange(data.nshifts)[:,None], solution["nurse"] + 1), workload)
+    load = nurse_load[shifts,caring + 1]
+    capacity = data.nurse_max_load_table[caring,shifts]
+    added = np.array(patient["workload_produced"])[offsets][None,:]
+    excess = np.maximum(0, load + added - capacity) - np.maximum(0, load - capacity)
+    cost += weights["nurse_eccessive_workload"]*(excess*in_shifts).sum(axis = 1)
+
+    # Age mix of the room on each day of the stay
+    scheduled = solution["admission_day"] >= 0
+    age_min = data.occupant_age_min.copy()
+    age_max = data.occupant_age_max.copy()
+    stay = scheduled[data.stay_patient] & (data.stay_offset % spd == 0)
+    stay_day = solution["admission_day"][data.stay_patient[stay]] + data.stay_offset[stay]//spd
+    inside = stay_day < data.ndays
+    stay_patients = data.stay_patient[stay][inside]
+    np.minimum.at(age_min, (stay_day[inside], solution["room"][stay_patients]), data.patient_age[stay_patients])
+    np.maximum.at(age_max, (stay_day[inside], solution["room"][stay_patients]), data.patient_age[stay_patients])
+    room_min = age_min[days,r[:,None]]
+    room_max = age_max[days,r[:,None]]
+    occupied = room_max >= 0
+    age = patient["age_index"]
+    before = np.where(occupied, room_max - room_min, 0)
+    after = np.where(occupied, np.maximum(room_max, age) - np.minimum(room_min, age), 0)
+    cost += weights["room_mixed_age"]*((after - before)*in_days).sum(axis = 1)
+
+    return np.where(feasible, cost, np.inf)
 
-    solution = __update_allocations__(data,solution)
-        
-    # Return modifed solution
+
+"""
+RUIN AND RECREATE MOVES
+A block of patients (one admission day, room or surgeon) is taken out and put back greedily, in regret order.
+"""
+
+# Most patients taken out by a ruin
+ruin_size = 8
+
+# Remove the patients of a random day, room or surgeon and reinsert them
+def ruin_and_recreate(data,solution):
+    # Get all of the assigned patients
+    assigned_patients = __assigned_patients(solution)
+    if(len(assigned_patients) == 0):
+        return solution
+    # The block of a random admitted patient
+    p = rd.choice(assigned_patients)
+    kind = rd.choice(["day", "room", "surgeon"])
+    if(kind == "day"):
+        block = np.flatnonzero(solution["admission_day"] == solution["admission_day"][p])
+    elif(kind == "room"):
+        block = np.flatnonzero((solution["admission_day"] >= 0) & (solution["room"] == solution["room"][p]))
+    else:
+        block = np.flatnonzero((solution["admission_day"] >= 0) & (data.patient_surgeon == data.patient_surgeon[p]))
+    ruined = rd.sample(block.tolist(), min(ruin_size, len(block)))
+    # Ruin
+    previous = {q: sol.patient_assignment(solution, q) for q in ruined}
+    for q in ruined:
+        __apply_patient_change(data, solution, q, None)
+    # Recreate
+    left_out = []
+    for q in __recreate(data, solution, ruined):
+        # A mandatory patient which cannot be admitted again goes back where it was if it still fits
+        if(data.patient_is_mandatory[q] and __hard_feasible(data, solution, q, *previous[q])):
+            __apply_patient_change(data, solution, q, previous[q])
+        elif(data.patient_is_mandatory[q]):
+            left_out.append(q)
+    # Undoing the whole ruin rather than leaving a mandatory patient out
+    if(len(left_out) > 0):
+        for q in ruined:
+            if(solution["admission_day"][q] >= 0):
+                __apply_patient_change(data, solution, q, None)
+        for q in ruined:
+            __apply_patient_change(data, solution, q, previous[q])
     return solution
 
 
+def __recreate(data, solution, patients):
+    """
+    Admits the patients one at a time with greedy_patient_allocation (the earliest day each one fits in a room covered by a nurse),
+    the patient with the largest regret (delay of its second option less that of its first) first.
+    Mandatory patients go before the others and patients with a single option before those with more.
+    The options of a patient are only looked for again when an admission takes the room, theater or surgeon time they use
+    (admissions only take capacity, so the other options stay the first ones that fit).
+    Returns the patients left unscheduled.
+    """
+    options = {q: __recreate_options(data, solution, q) for q in patients}
+    left_out = [q for q in patients if len(options[q]) == 0]
+    remaining = [q for q in patients if len(options[q]) > 0]
+    while(len(remaining) > 0):
+        q = max(remaining, key = lambda q: (bool(data.patient_is_mandatory[q]),
+                                            options[q][1][0] - options[q][0][0] if len(options[q]) > 1 else np.inf))
+        __apply_patient_change(data, solution, q, options[q][0])
+        remaining.remove(q)
+        for x in [x for x in remaining if any(__options_clash(data, q, options[q][0], x, option) for option in options[x])]:
+            options[x] = __recreate_options(data, solution, x)
+            if(len(options[x]) == 0):
+                remaining.remove(x)
+                left_out.append(x)
+    return left_out
+
+
+# The first two options of patient q (earliest days first) for the recreate
+def __recreate_options(data, solution, q):
+    return list(itertools.islice((option for option in (grd.greedy_patient_allocation(data, solution, d, q, rd)
+                                                        for d in data.patient_list[q]["possible_admission_days"])
+                                  if option is not None and __covered_option(data, solution, q, option)), 2))
+
+# Whether admitting patient q with assignment takes room, theater or surgeon time used by option of patient x
+def __options_clash(data, q, assignment, x, option):
+    d, r, t = assignment
+    dx, rx, tx = option
+    if(d == dx and (t == tx or data.patient_surgeon[q] == data.patient_surgeon[x])):
+        return True
+    return r == rx and d < dx + data.patient_list[x]["length_of_stay"] and dx < d + data.patient_list[q]["length_of_stay"]
+
+
 """
 NURSE THEMED MOVES
 """
 
 def add_nurse_room(data,solution):
     # Calling from a list of all nurses and selecting one
-    nurse_id = rd.choices(data.all_nurses)[0]
+    n = rd.randrange(len(data.nurse_list))
     # Apply move
-    solution = __add_nurse_room(data,solution,nurse_id)
+    solution = __add_nurse_room(data,solution,n)
     # Return modified solution
     return solution
 
 
 def remove_nurse_room(data,solution):
     # Calling from a list of all nurses and selecting one
-    nurse_id = rd.choices(data.all_nurses)[0]
+    n = rd.randrange(len(data.nurse_list))
     # Apply move
-    solution = __remove_nurse_room(data,solution,nurse_id)
+    solution = __remove_nurse_room(data,solution,n)
     # Return modified solution
     return solution
 
 
 def nurse_compound(data,solution):
     # Calling from a list of all nurses and selecting one
-    nurse_id = rd.choices(data.all_nurses)[0]
+    n = rd.randrange(len(data.nurse_list))
     # Apply move
-    solution = __remove_nurse_room(data,solution,nurse_id)
-    solution = __add_nurse_room(data,solution,nurse_id)
+    solution = __remove_nurse_room(data,solution,n)
+    solution = __add_nurse_room(data,solution,n)
     # Return modified solution
     return solution
 
 
-def __add_nurse_room(data,solution,nurse_id):
-    nurse = data.nurse_dict[nurse_id]
-    
-    # Selecting a shift and a room to add
-    all_rooms = [room["id"] for room in data.data["rooms"]]
-    shift = rd.choices(nurse["working_shifts"])[0]
-    room = rd.choices(all_rooms)[0]
-
-    # Updating the working shifts
-    new_nurse_assignments = []
-    for nurse_sol in solution["nurses"]:
-        if(nurse_sol["id"] == nurse_id):
-            updated_solution = False
-            # Try and modify existing assignment
-            for assignment in nurse_sol["assignments"]:
-                if(assignment["day"] == shift["day"] and
-                    assignment["shift"] == shift["shift"]):
-                    assignment["rooms"].append(room)
-                    assignment["rooms"] = list(set(assignment["rooms"]))
-                    updated_solution = True
-            # If not modifying existing, add new
-            if not updated_solution:
-                new_assignment = {"day": shift["day"],
-                                    "shift": shift["shift"],
-                                    "rooms": [room]}
-                nurse_sol["assignments"].append(new_assignment)
-            new_nurse_assignments.append(nurse_sol)
-        else:
-            new_nurse_assignments.append(nurse_sol)
-
-    # Updating the solution
-    solution["nurses"] = new_nurse_assignments
-
-    solution = __update_allocations__(data,solution)
+def reoptimise_nurses(data,solution):
+    # Selecting a shift and assigning its nurses optimally given everything else
+    s = rd.randrange(data.nshifts)
+    assignment = nrs.shift_assignment(data, solution, s)
+    for r in np.flatnonzero(solution["nurse"][s] != assignment):
+        __apply_nurse_change(data, solution, s, int(r), int(assignment[r]))
+    # Return modified solution
+    return solution
+
+
+def __add_nurse_room(data,solution,n):
+    # Selecting one of the nurse's working shifts and a room to add (replacing any nurse covering it)
+    shifts = data.nurse_list[n]["shifts"]
+    if(len(shifts) == 0):
+        return solution
+    s = rd.choice(shifts)
+    r = rd.randrange(len(data.room_ids))
+    if(solution["nurse"][s,r] != n):
+        __apply_nurse_change(data, solution, s, r, n)
     
     # Return modified solution
     return solution
 
 
-def __remove_nurse_room(data,solution,nurse_id):
-    # Updating the working shifts
-    new_nurse_assignments = []
-    for nurse_sol in solution["nurses"]:
-        # Check if nurse selected is chosen
-        if(nurse_sol["id"] == nurse_id):
-            # Checking nurse has assignments
-            if(len(nurse_sol["assignments"]) == 0):
-                new_nurse_assignments.append(nurse_sol)
-            else:
-                # Choose an assignment
-                assignment_index = rd.choices(list(range(len(nurse_sol["assignments"]))))[0]
-                new_assignment = nurse_sol["assignments"][assignment_index]
-                # Check a room is assigned
-                if(len(new_assignment["rooms"]) == 0):
-                    new_nurse_assignments.append(nurse_sol)
-                else:
-                    # Modify rooms
-                    new_assignment["rooms"] = rd.sample(new_assignment["rooms"],
-                                                        k = len(new_assignment["rooms"])-1)
-                    # Modify solution
-                    nurse_sol["assignments"][assignment_index] = new_assignment
-                    new_nurse_assignments.append(nurse_sol)
-        else:
-            new_nurse_assignments.append(nurse_sol)
-
-    # Updating the solution
-    solution["nurses"] = new_nurse_assignments
-
-    solution = __update_allocations__(data,solution)
+def __remove_nurse_room(data,solution,n):
+    # Choosing one of the rooms covered by the nurse
+    assignments = np.argwhere(solution["nurse"] == n)
+    if(len(assignments) == 0):
+        return solution
+    s, r = assignments[rd.randrange(len(assignments))]
+    __apply_nurse_change(data, solution, int(s), int(r), -1)
     
     # Return modified solution
     return solution
+
+
+"""
+Registry of the low level heuristics used by the hyper-heuristic and the parity check.
+- "category": what the move changes ("patient" or "nurse")
+- "components": the solution arrays the move may write
+- "cost": rough time of a call relative to change_patient_room (measured on the instances in data/instances)
+New moves are added with register_move, the selection methods call moves[name]["function"] directly.
+"""
+
+patient_components = ("admission_day", "room", "theater",
+                      "room_allocation", "gender_allocation", "theater_allocation", "surgeon_allocation")
+nurse_components = ("nurse",)
+
+moves = {}
+
+def register_move(function, category, cost):
+    moves[function.__name__] = {"function": function,
+                                "category": category,
+                                "components": patient_components if category == "patient" else nurse_components,
+                                "cost": cost}
+
+register_move(insert_patient, "patient", 1)
+register_move(insert_patient_empty_room, "patient", 3)
+register_move(insert_patient_to_available_surgeon, "patient", 5)
+register_move(remove_patient, "patient", 0.2)
+register_move(remove_patient_any, "patient", 0.6)
+register_move(remove_then_insert_patient, "patient", 1)
+register_move(remove_then_insert_patient_any, "patient", 1)
+register_move(change_patient_room, "patient", 1)
+register_move(change_patient_admission, "patient", 1)
+register_move(change_patient_theater, "patient", 1.2)
+register_move(change_patient_compound1, "patient", 2.2)
+register_move(change_patient_compound2, "patient", 1.6)
+register_move(change_patient_compound3, "patient", 1.6)
+register_move(best_patient_room, "patient", 10)
+register_move(best_patient_admission, "patient", 10)
+register_move(best_patient_theater, "patient", 10)
+register_move(ruin_and_recreate, "patient", 10)
+register_move(add_nurse_room, "nurse", 0.2)
+register_move(remove_nurse_room, "nurse", 0.4)
+register_move(nurse_compound, "nurse", 0.6)
+register_move(reoptimise_nurses, "nurse", 12)
+
+
+def move_names(enabled = None, disabled = None):
+    """
+    Names of the registered moves (in registration order), only those in enabled if given and none of those in disabled.
+    """
+    for name in list(enabled or []) + list(disabled or []):
+        if(name not in moves):
+            raise ValueError("Unknown low level heuristic {}".format(name))
+    return [name for name in moves if (not enabled or name in enabled) and name not in (disabled or [])]
@@ -0,0 +1,97 @@
+"""
+this module assigns nurses to rooms, one shift at a time, with the patient assignments fixed.
+
+The nurses working a shift are matched to its occupied rooms with an assignment problem (scipy's linear_sum_assignment):
+- each nurse gets a few "slots", the j-th room given to a nurse costing the excess workload it would add
+  if the nurse already had j rooms of average workload (so rooms are spread over the nurses),
+- a room costs the skill shortfall of the nurse for the people in it (RoomSkillLevel),
+- a room costs one more distinct nurse for every person in it who is not cared for by the nurse in another shift of their stay
+  (ContinuityOfCare),
+all with the weights of the instance. Empty rooms are then covered by the nurses with the most load left,
+so patients can be moved into them without leaving them uncovered.
+"""
+
+import numpy as np
+from scipy.optimize import linear_sum_assignment
+import src.data.solution as sol
+
+def assign_nurses(data, solution):
+    """
+    Assigns the nurses of every shift in turn (earlier shifts are then known for the continuity of care of later ones).
+    """
+    workload, skill_demand = sol.room_shift_demand(data, solution)
+    stays = room_stays(data, solution)
+    nurse = sol.writable(solution, "nurse")
+    nurse[...] = -1
+    solution.pop("hash", None)
+    for s in range(data.nshifts):
+        nurse[s] = shift_assignment(data, solution, s, workload, skill_demand, stays)
+    return solution
+
+
+def shift_assignment(data, solution, s, workload = None, skill_demand = None, stays = None):
+    """
+    Returns the nurse of every room in shift s (-1 if no nurse works the shift) given the nurses of the other shifts.
+    The solution is not changed.
+    """
+    if(workload is None):
+        workload, skill_demand = sol.room_shift_demand(data, solution)
+    if(stays is None):
+        stays = room_stays(data, solution)
+    nrooms = len(data.room_ids)
+    assignment = np.full(nrooms, -1)
+    nurses = np.array(data.shift_nurses[s], dtype=int)
+    if(len(nurses) == 0):
+        return assignment
+    weights = data.weights
+    capacity = data.nurse_max_load_table[nurses,s]
+    occupied = np.flatnonzero(solution["room_allocation"][s//data.shifts_per_day] > 0)
+
+    if(len(occupied) > 0):
+        # Skill shortfall [room, nurse]
+        cost = weights["room_nurse_skill"]*(skill_demand[s,occupied] @ data.skill_shortfall[data.nurse_skill[nurses]].T)
+
+        # New distinct nurses [room, nurse] for the people in the room
+        nurse_column = {n: i for i, n in enumerate(nurses)}
+        for i, r in enumerate(occupied):
+            for start, end in stays[r]:
+                if(not start <= s < end):
+                    continue
+                cost[i] += weights["continuity_of_care"]
+                others = solution["nurse"][start:end,r]
+                for n in set(others[np.arange(start, end) != s].tolist()):
+                    if(n in nurse_column):
+                        cost[i,nurse_column[n]] -= weights["continuity_of_care"]
+
+        # Excess workload of the j-th room of each nurse [room, slot]
+        slots = -(-len(occupied)//len(nurses)) + 1
+        room_load = workload[s,occupied][:,None,None]
+        load_before = np.arange(slots)[None,None,:]*room_load.mean()
+        excess = (np.maximum(0, load_before + room_load - capacity[None,:,None]) -
+                  np.maximum(0, load_before - capacity[None,:,None]))
+        cost = cost[:,:,None] + weights["nurse_eccessive_workload"]*excess
+        rows, columns = linear_sum_assignment(cost.reshape(len(occupied), len(nurses)*slots))
+        assignment[occupied[rows]] = nurses[columns//slots]
+
+    # Covering the empty rooms with the nurses with the most load left
+    remaining = capacity - np.bincount(np.searchsorted(nurses, assignment[occupied]),
+                                       weights = workload[s,occupied], minlength = len(nurses))
+    for r in np.flatnonzero(assignment < 0):
+        i = int(np.argmax(remaining))
+        assignment[r] = nurses[i]
+        remaining[i] -= workload[s,r]
+    return assignment
+
+
+def room_stays(data, solution):
+    """
+    (first shift, end shift) of the stay of every scheduled patient and occupant, for each room.
+    """
+    stays = [[] for r in data.room_ids]
+    for p in np.flatnonzero(solution["admission_day"] >= 0).tolist():
+        d = int(solution["admission_day"][p])
+        stay_end = min(data.ndays, d + data.patient_list[p]["length_of_stay"])
+        stays[solution["room"][p]].append((d*data.shifts_per_day, stay_end*data.shifts_per_day))
+    for occupant in data.occupant_list:
+        stays[occupant["room"]].append((0, min(data.ndays, occupant["length_of_stay"])*data.shifts_per_day))
+    return stays
@@ -1,19 +1,25 @@
 import json
-import subprocess
 import time
+import queue
 import multiprocessing as mp
+from collections import OrderedDict
 import numpy as np
 import random as rd
-import tempfile
 import pickle
 from ast import literal_eval
 
 import src.optimise.heuristics as llh
 import src.optimise.greedy as grd
+import src.optimise.evaluator as evl
+import src.optimise.validator as val
+import src.data.solution as sol
 from src.data.instance import Data
 from src.policies import qlearner
 from src.policies import acceptance
+from src.policies.pursuit import AdaptivePursuit
 from src.utils.plotter import solution_summary
+from src.utils.system import available_cores
+from src.utils.telemetry import MoveTelemetry
 
 # Main optimisation function
 def main(input_file, 
@@ -23,7 +29,16 @@ def main(input_file,
          verbose = False, 
          heuristic_selection = "random", 
          sequence_length=1,
-         acceptance_selection = "sa"):
+         acceptance_selection = "sa",
+         evaluator = "python",
+         debug = False,
+         parallel_mode = "sync",
+         cores = 4,
+         pool_size = None,
+         starts = 0,
+         moves = None,
+         disabled_moves = None,
+         telemetry_file = None):
 
     # Open and read the JSON file
     with open(input_file, 'r') as file:
@@ -40,20 +55,32 @@ def main(input_file,
                                     verbose = verbose,
                                     heuristic_selection = heuristic_selection,
                                     sequence_length = sequence_length,
-                                    acceptance_selection = acceptance_selection)
-
-    # Run an optimisation method for initial
-    solution = optimisation_object.optimise(method = "greedy")
+                                    acceptance_selection = acceptance_selection,
+                                    evaluator = evaluator,
+                                    debug = debug,
+                                    parallel_mode = parallel_mode,
+                                    cores = cores,
+                                    pool_size = pool_size,
+                                    moves = moves,
+                                    disabled_moves = disabled_moves)
+
+    # Run an optimisation method for initial (several randomised greedy starts on every core if asked)
+    if(starts > 1):
+        solution = optimisation_object.optimise(method = "multistart", starts = starts)
+    else:
+        solution = optimisation_object.optimise(method = "greedy")
     initial_costs = optimisation_object.solution_check(solution)
     if(initial_costs["Violations"] > 0):
         print(f"Main function unable to find feasible solution!")
         print()
-        return solution, optimisation_object.costs
+        return sol.solution_to_json(optimisation_object.data, solution), optimisation_object.costs
 
     # Run improvement
     if(heuristic_selection != "none"):
-        solution, costs = optimisation_object.improvement_hyper_heuristic(solution)
+        solution, costs = optimisation_object.improvement_hyper_heuristic(solution, initial_pool = optimisation_object.initial_pool)
         print(optimisation_object.solution_check(solution))
+        if(telemetry_file):
+            optimisation_object.telemetry.export(telemetry_file)
     else:
         optimisation_object.solution_collect_costs(solution)
         costs = optimisation_object.costs
@@ -65,7 +92,73 @@ def main(input_file,
     print(f"Main function completed!")
     print()
 
-    return solution, costs
+    return sol.solution_to_json(optimisation_object.data, solution), costs
+
+# Optimiser held by each worker process of the hyper-heuristic
+worker_optimiser = None
+
+# Scores kept by the evaluation cache of each process
+evaluation_cache_size = 10000
+
+def init_worker(optimiser, shared_learning = None):
+    global worker_optimiser
+    worker_optimiser = optimiser
+    if(shared_learning is not None):
+        optimiser.attach_learning_state(shared_learning)
+
+def adjust_solution(task):
+    """
+    Applies the low level heuristics of the selection method to a solution in a worker process.
+    Returns the new solution and its score (None if the validator scores it in the main process).
+    """
+    solution, seed, operators, parent_value = task
+    optimiser = worker_optimiser
+    rd.seed(seed)
+    np.random.seed(seed)
+    # The learners score each step from the changes of its move, on top of the score of the solution
+    # (the solution is only evaluated in full if its score is not known)
+    evaluation = None
+    evaluation_time = 0
+    if (operators is None and optimiser.heuristic_selection in ['qlearner', 'mcrl']):
+        if(parent_value is None):
+            t0 = time.perf_counter()
+            evaluation = evl.Evaluation(optimiser.data, solution)
+            evaluation_time = time.perf_counter() - t0
+        else:
+            parent = dict(parent_value)
+            parent["Cost"] -= 1000*parent["Violations"]
+            evaluation = evl.Evaluation(optimiser.data, solution, parent = parent)
+    # Find which strategy selection is used
+    if (operators is not None):
+        new_solution = optimiser.sequence_solution_adjustment(solution, operators)
+    elif (optimiser.heuristic_selection == 'random'):
+        new_solution = optimiser.random_solution_adjustment(solution, seed)
+    elif (optimiser.heuristic_selection == 'qlearner'):
+        new_solution = optimiser.qlearner_solution_adjustment(solution, evaluation)
+    elif (optimiser.heuristic_selection == 'mcrl'):
+        new_solution = optimiser.mcrl_solution_adjustment(solution, evaluation)
+    if(optimiser.evaluator == "python"):
+        t0 = time.perf_counter()
+        if(evaluation is None):
+            value = optimiser.solution_score(new_solution)
+        else:
+            value = evaluation.summary()
+            value["Cost"] += 1000*value["Violations"]
+        new_solution["evaluation_time"] = evaluation_time + time.perf_counter() - t0
+        return new_solution, value
+    return new_solution, None
+
+def greedy_start(task):
+    """
+    Builds a randomised greedy solution in a worker process (the deterministic greedy if the seed is None).
+    Returns the solution and its score (None if the validator scores it in the main process).
+    """
+    seed, time_limit = task
+    optimiser = worker_optimiser
+    solution = grd.greedy_allocation(optimiser.data, time_limit = time_limit, time_tolerance = 0, seed = seed)
+    if(optimiser.evaluator == "python"):
+        return solution, optimiser.solution_score(solution)
+    return solution, None
 
 # Optimisation class
 class Optimiser():
@@ -77,12 +170,22 @@ class Optimiser():
                  verbose = False, 
                  heuristic_selection = "qlearner", 
                  sequence_length = 1,
-                 acceptance_selection = "sa"):
+                 acceptance_selection = "sa",
+                 evaluator = "python",
+                 debug = False,
+                 parallel_mode = "sync",
+                 cores = 4,
+                 pool_size = None,
+                 moves = None,
+                 disabled_moves = None):
 
         # Get number of successful improvements over all iterations
         
         self.verbose = verbose
 
+        # Cross-check the allocations kept by the moves against a full rebuild
+        self.debug = debug
+
         self.time_limit = time_limit
 
         # If logging we will record the hits and successes over time
@@ -92,14 +195,17 @@ class Optimiser():
         
         self.heuristic_selection = heuristic_selection # Random or Qlearner
         self.acceptance_selection = acceptance_selection # Improve only, r2r or SA
+        self.evaluator = evaluator # In-process python evaluator or the validator binary
+        self.parallel_mode = parallel_mode # Generations of moves (sync) or moves accepted as they finish (async)
 
         self.instance_file_name = instance_file_name
-        # Importing low level heuristics
-        self.llh_names = [name for name in dir(llh) if
-                          callable(getattr(llh,name)) and
-                          not name.startswith("__")
-                          ]
-        if self.heuristic_selection == "qlearner":
+        # Low level heuristics from the registry (all of them unless moves or disabled_moves are given)
+        self.llh_names = llh.move_names(moves, disabled_moves)
+        self.telemetry = MoveTelemetry(self.llh_names)
+        # Time-aware selection: the main process picks the moves, rewarding cost improvement per second of CPU
+        if self.heuristic_selection == "pursuit":
+            self.pursuit = AdaptivePursuit(len(self.llh_names))
+        if self.heuristic_selection in ["qlearner", "mcrl"]:
             self.llh_names = self.llh_names+["End"]
         self.llh_dict = {}
         for name in self.llh_names:
@@ -107,8 +213,13 @@ class Optimiser():
 
         
 
-        # Key values for optimiser
-        self.cores = 4
+        # Key values for optimiser (4 worker processes as in the competition, 0 or None for every CPU available,
+        # and one solution in the pool per worker)
+        self.cores = cores if cores else available_cores()
+        self.pool_size = pool_size if pool_size else self.cores
+        self.moves_evaluated = 0
+        self.initial_pool = None # Best starts of the multi-start greedy, seeding the solution pool
+        self.evaluation_cache = OrderedDict() # Solution hash -> score (see solutions_score)
         self.time_tolerance = time_tolerance
         self.start_time=0
         # Processing instance data
@@ -159,6 +270,8 @@ class Optimiser():
         # rate of decay for decaying e-greedy
         self.explore_decay_rate = 0.00005
 
+        # Episodes are counted in an array so the count can be shared by the workers (see share_learning_state)
+        self.episode_count = np.zeros(1)
         self.episode = 0
 
         self.returns=np.zeros((self.max_sequence_length,number_of_low_level_heuristics+2,number_of_low_level_heuristics + 2))
@@ -169,23 +282,88 @@ class Optimiser():
     Solution checking
     """
 
+    @property
+    def episode(self):
+        return int(self.episode_count[0])
+
+    @episode.setter
+    def episode(self, value):
+        self.episode_count[0] = value
+
+    def learning_tables(self):
+        return {"q_table": self.agent.getQTable(),
+                "NVisits": self.NVisits,
+                "returns": self.returns,
+                "mc_table": self.mc_table,
+                "episode_count": self.episode_count}
+
+    def share_learning_state(self):
+        """
+        Moves the tables of the Q-learner and MCRL into shared memory, so every worker learns from the moves of all workers
+        and the learning carries on over the whole run. Returns what the workers need to attach to the tables
+        (None if the selection method does not learn).
+        The workers update the tables without locks: two workers updating the same entry at once can lose one of the updates.
+        """
+        if(self.heuristic_selection not in ["qlearner", "mcrl"]):
+            return None
+        shared_learning = {}
+        for name, table in self.learning_tables().items():
+            shared_learning[name] = (mp.RawArray("d", table.size), table.shape)
+            np.frombuffer(shared_learning[name][0]).reshape(table.shape)[...] = table
+        self.attach_learning_state(shared_learning)
+        return shared_learning
+
+    def attach_learning_state(self, shared_learning):
+        tables = {name: np.frombuffer(array).reshape(shape) for name, (array, shape) in shared_learning.items()}
+        self.agent.setQTable(tables["q_table"])
+        self.NVisits = tables["NVisits"]
+        self.returns = tables["returns"]
+        self.mc_table = tables["mc_table"]
+        self.episode_count = tables["episode_count"]
+
     def setStartTime(self,time):
         self.start_time=time
 
     def solution_check(self, solution):
-        # Check solution
+        # Check solution in-process
+        if(self.evaluator == "python"):
+            return evl.evaluate(self.data, solution)
+        # Check solution with the validator
+        return self.validator_check(self.validator_output([solution])[0])
+
+
+    def solutions_check(self, solutions):
+        # Check solutions in-process
+        if(self.evaluator == "python"):
+            return [evl.evaluate(self.data, solution) for solution in solutions]
+        # Check solutions concurrently with the validator pool
+        return [self.validator_check(output) for output in self.validator_output(solutions)]
+
+    
+    def solution_collect_costs(self, solution):
+        # Collect costs in-process
+        if(self.evaluator == "python"):
+            costs = evl.evaluate_costs(self.data, solution)
+            for name in costs:
+                self.costs[name].append(float(costs[name]))
+            return
+        # Collect costs with the validator
+        for line in self.validator_output([solution])[0].splitlines():
+            if('(' in line and '.' in line):
+                self.costs[line.split('.')[0]].append(float(line.split('.')[-1].split()[0]))
+
+
+    def validator_output(self, solutions):
+        # Validator servers keep the instance loaded between calls (and read the competition format)
+        solutions = [sol.solution_to_json(self.data, solution) for solution in solutions]
+        return val.get_pool(self.instance_file_name, self.cores).check(solutions)
+
+
+    def validator_check(self, output):
         violations = 0
         cost = 0
         reasons = []
-        with tempfile.NamedTemporaryFile() as solution_file:
-            solution_file.write(json.dumps(solution).encode())
-            solution_file.seek(0) # Not sure what this does (hard to find documentation) but makes it run quicker
-            result = subprocess.run(
-                ['./bin/IHTP_Validator', self.instance_file_name, solution_file.name],
-                capture_output = True, # Python >= 3.7 only
-                text = True # Python >= 3.7 only
-                )
-        for line in result.stdout.splitlines():
+        for line in output.splitlines():
             if("." in line and len(line.split()) == 1):
                 if(int(line.split(".")[-1]) != 0):
                     reasons.append(line.split(".")[0])
@@ -198,61 +376,143 @@ class Optimiser():
         # Return violations and cost
         return {"Violations": violations, "Cost": cost, "Reasons": reasons}
 
-    
-    def solution_collect_costs(self, solution):
-
-        with tempfile.NamedTemporaryFile() as solution_file:
-            solution_file.write(json.dumps(solution).encode())
-            solution_file.seek(0) # Not sure what this does (hard to find documentation) but makes it run quicker
-            result = subprocess.run(
-                ['./bin/IHTP_Validator', self.instance_file_name, solution_file.name],
-                capture_output = True, # Python >= 3.7 only
-                text = True # Python >= 3.7 only
-                )
-        for line in result.stdout.splitlines():
-            if('(' in line and '.' in line):
-                self.costs[line.split('.')[0]].append(float(line.split('.')[-1].split()[0]))
                 
     def solution_score(self, solution):
-        values = self.solution_check(solution)
-        values["Cost"] += 1000*values["Violations"]
-        return values
+        return self.solutions_score([solution])[0]
+
+    def solutions_score(self, solutions):
+        """
+        Scores solutions (cost plus 1000 per violation). Scores of solutions with the same hash as a recently scored one
+        are taken from the evaluation cache (least recently used scores are dropped beyond evaluation_cache_size).
+        """
+        keys = [sol.solution_hash(self.data, solution) for solution in solutions]
+        for solution, key in zip(solutions, keys):
+            solution["cache_hit"] = key in self.evaluation_cache
+            # Time spent scoring each solution (for the move telemetry), none for a cache hit
+            solution["evaluation_time"] = 0.0
+            if(solution["cache_hit"]):
+                self.evaluation_cache.move_to_end(key)
+        missing = list(dict.fromkeys(key for key in keys if key not in self.evaluation_cache))
+        if(len(missing) > 0):
+            to_check = {key: solution for solution, key in zip(solutions, keys) if key in missing}
+            t0 = time.perf_counter()
+            checked = self.solutions_check([to_check[key] for key in missing])
+            check_time = (time.perf_counter() - t0)/len(missing)
+            for key in missing:
+                to_check[key]["evaluation_time"] = check_time
+            for key, value in zip(missing, checked):
+                value["Cost"] += 1000*value["Violations"]
+                self.evaluation_cache[key] = value
+            while(len(self.evaluation_cache) > evaluation_cache_size):
+                self.evaluation_cache.popitem(last = False)
+        return [dict(self.evaluation_cache[key]) for key in keys]
+
+
+    def cache_scores(self, solutions, values):
+        """
+        Adds the scores of solutions scored in the worker processes to the evaluation cache of the main process.
+        """
+        for solution, value in zip(solutions, values):
+            self.evaluation_cache[sol.solution_hash(self.data, solution)] = dict(value)
+        while(len(self.evaluation_cache) > evaluation_cache_size):
+            self.evaluation_cache.popitem(last = False)
+
+    def parent_value(self, solution):
+        """
+        Score of a solution of the pool for the learners, from the evaluation cache (None if it is not cached,
+        or if the selection does not learn in the workers).
+        """
+        if(self.heuristic_selection not in ['qlearner', 'mcrl']):
+            return None
+        key = sol.solution_hash(self.data, solution)
+        self.telemetry.record_parent(key in self.evaluation_cache)
+        if(key not in self.evaluation_cache):
+            return None
+        self.evaluation_cache.move_to_end(key)
+        return dict(self.evaluation_cache[key])
 
 
     """
     Optimisation functions
     """
 
-    def optimise(self, method = None):
+    def optimise(self, method = None, starts = 1):
         # Don't apply method
         if(method == None):
             print("Methods coming soon!")
-            solution = {"patients": [], "nurses": []}
+            solution = sol.new_solution(self.data)
         # Apply greedy heuristic
         elif(method == "greedy"):
             t0 = time.time()
-            solution = grd.greedy_allocation(self.data)
+            # The restarts get at most a tenth of the time limit, the rest is for the hyper-heuristic
+            solution = grd.greedy_allocation(self.data, time_limit = self.time_limit/10, time_tolerance = 0, verbose = self.verbose)
             print("Greedy approach took {} seconds".format(time.time()-t0))
+            self.record_restarts(solution)
+        # Apply randomised greedy heuristics in parallel
+        elif(method == "multistart"):
+            t0 = time.time()
+            solution = self.multistart_greedy(starts)
+            print("Multi-start greedy approach took {} seconds".format(time.time()-t0))
+            self.record_restarts(solution)
         # Method doesn't exist
         else:
-            solution = {"patients": [], "nurses": []}
+            solution = sol.new_solution(self.data)
         # Returning the solution
         return solution
 
 
+    def multistart_greedy(self, starts):
+        """
+        Runs starts greedy constructions on the worker processes: the deterministic greedy and randomised orderings.
+        The best pool_size feasible starts are kept in self.initial_pool (best first) and the best one is returned.
+        If no start is feasible, the best start is returned and the pool is left empty.
+        """
+        # The starts share a tenth of the time limit, like the single greedy
+        rounds = -(-starts//self.cores)
+        tasks = [(None if i == 0 else rd.randint(1,100000), self.time_limit/10/rounds) for i in range(starts)]
+        with mp.Pool(self.cores, initializer = init_worker, initargs = (self,)) as p:
+            results = p.map(greedy_start, tasks)
+        solutions = [result[0] for result in results]
+        values = [result[1] for result in results]
+        if(self.evaluator != "python"):
+            values = self.solutions_score(solutions)
+        order = sorted(range(starts), key = lambda i: values[i]["Cost"])
+        self.initial_pool = [solutions[i] for i in order if values[i]["Violations"] == 0][:self.pool_size]
+        if self.verbose:
+            print("Multi-start greedy: {} of {} starts feasible, best costs {}".format(
+                sum(value["Violations"] == 0 for value in values), starts, [values[i]["Cost"] for i in order[:self.pool_size]]))
+        return solutions[order[0]]
+
+
+    def record_restarts(self, solution):
+        """
+        Keeps the greedy restarts of the starting solution in the telemetry and reports them.
+        """
+        self.telemetry.greedy_restarts = solution.pop("restarts", [])
+        print("Greedy restarts: {}, mandatory patients not allocated {}, seconds {}".format(
+            len(self.telemetry.greedy_restarts),
+            [restart["not_allocated"] for restart in self.telemetry.greedy_restarts],
+            ["{:.3f}".format(restart["seconds"]) for restart in self.telemetry.greedy_restarts]))
+
+
     """
     Hyper-heurisic improvemen
     """
     
-    def improvement_hyper_heuristic(self, solution, pool_size = 4):
+    def improvement_hyper_heuristic(self, solution, pool_size = None, initial_pool = None):
         """
-        The improvement heuristic applies 4 moves at the same time to the current solution.
+        The improvement heuristic applies pool_size moves at the same time to the current solution.
+        The pool starts from the solutions of initial_pool if given (e.g. multi-start greedy), else copies of solution.
         It will never accept an infeasible solution.
         If we have multiple feasible the "best" solution has a chance of being selected as current.
         100% chance if solution is improving or equivalent.
         p% chance if the solution is not improving.
         The best solution is always saved.
         """
+        if(pool_size is None):
+            pool_size = self.pool_size
+        if(self.parallel_mode == "async"):
+            return self.asynchronous_hyper_heuristic(solution, pool_size, initial_pool)
         
         # Preallocating features
         print(f"Starting hyper-heuristic")
@@ -262,84 +522,206 @@ class Optimiser():
         current_solution_value = best_solution_value
         
         # Making copies of solution
-        solution_pool = []
-        previous_values = []
-        for p in range(pool_size):
-            solution_pool.append(current_solution)
-            previous_values.append(current_solution_value)
+        solution_pool, previous_values = self.starting_pool(solution, best_solution_value, pool_size, initial_pool)
         
         # Applying heuristic
         self.setStartTime(time.time())
         t_end = time.time() + (self.time_limit - self.time_tolerance)
-        while time.time() < t_end:
-            # Applying moves
-            with mp.Pool(self.cores) as p:
-                # Find which strategy selection is used
-                if (self.heuristic_selection == 'random'):
-                    new_solutions = p.starmap(self.random_solution_adjustment,[(sol,rd.randint(1,100000)) for sol in solution_pool])
-                elif (self.heuristic_selection == 'qlearner'):
-                    new_solutions = p.map(self.qlearner_solution_adjustment,solution_pool)   
-                elif (self.heuristic_selection == 'mcrl'):
-                    new_solutions = p.map(self.mcrl_solution_adjustment,solution_pool) 
-                values = p.map(self.solution_score,new_solutions)
-
-            # Append number of attempts
-            if self.verbose:
-                self.hits['tried'] += 1
-
-            # Selecting best solution of this pool
-            temp_best_index = np.argmin([value['Cost'] for value in values])
-            temp_best =  new_solutions[temp_best_index] # This is the json for the temp_best solution
-
-            # Record costs and violations
-            temp_best_value = values[temp_best_index]['Cost']
-            temp_best_violations = values[temp_best_index]["Violations"]
+        # The workers are started once and keep their own copy of the optimiser (instance data, learning state)
+        shared_learning = self.share_learning_state()
+        with mp.Pool(self.cores, initializer = init_worker, initargs = (self, shared_learning)) as p:
+            while time.time() < t_end:
+                # Applying moves (only the solutions and seeds are sent to the workers)
+                results = p.map(adjust_solution, [(candidate, rd.randint(1,100000), self.choose_operators(), self.parent_value(candidate))
+                                                  for candidate in solution_pool])
+                new_solutions = [result[0] for result in results]
+                values = [result[1] for result in results]
+                # The validator pool scores the candidates concurrently
+                if(self.evaluator != "python"):
+                    values = self.solutions_score(new_solutions)
+                else:
+                    self.cache_scores(new_solutions, values)
+                self.moves_evaluated += len(new_solutions)
+                for new_solution, value, previous_value in zip(new_solutions, values, previous_values):
+                    self.telemetry.record(new_solution, value, previous_value)
+                    self.reward_operators(new_solution, value, previous_value)
+
+                # Append number of attempts
+                if self.verbose:
+                    self.hits['tried'] += 1
+
+                # Selecting best solution of this pool
+                temp_best_index = np.argmin([value['Cost'] for value in values])
+                temp_best =  new_solutions[temp_best_index] # This is the json for the temp_best solution
+
+                # Record costs and violations
+                temp_best_value = values[temp_best_index]['Cost']
+                temp_best_violations = values[temp_best_index]["Violations"]
             
-            # Saving best solution
-            if(temp_best_value < best_solution_value):
-                if(temp_best_violations > 0):
-                   continue 
-
-                best_solution = temp_best
-                best_solution_value = temp_best_value
-                # Dont quite get the point of this (?)
-                # Assume its just collecting costs over time but why don't you just collect all this information from the start when running the intiial pool instead of at the end?
-                # Also since its for plotting, we'll only do this is the plotting option is chosen
-                self.solution_collect_costs(temp_best)
-
-            # Deciding whether to accept new solution as current solution
-            if(self.acceptance_selection == "improve_only"):
-                solution_pool, previous_values = acceptance.improve_only()
+                # Saving best solution
+                if(temp_best_value < best_solution_value):
+                    if(temp_best_violations > 0):
+                       continue 
+
+                    best_solution = temp_best
+                    best_solution_value = temp_best_value
+                    # Dont quite get the point of this (?)
+                    # Assume its just collecting costs over time but why don't you just collect all this information from the start when running the intiial pool instead of at the end?
+                    # Also since its for plotting, we'll only do this is the plotting option is chosen
+                    self.solution_collect_costs(temp_best)
+
+                # Deciding whether to accept new solution as current solution
+                if(self.acceptance_selection == "improve_only"):
+                    solution_pool, previous_values = acceptance.improve_only()
             
-            elif(self.acceptance_selection == "r2r"):
-                solution_pool, previous_values = acceptance.bestrr(
-                    values,
-                    new_solutions,
-                    temp_best_value)
+                elif(self.acceptance_selection == "r2r"):
+                    solution_pool, previous_values = acceptance.bestrr(
+                        values,
+                        new_solutions,
+                        temp_best_value)
             
-            else:
-                solution_pool, previous_values = acceptance.simulated_annealing(
-                    values,
-                    new_solutions,
-                    previous_values,
-                    self.start_time,
-                    self.time_limit)
+                else:
+                    solution_pool, previous_values = acceptance.simulated_annealing(
+                        values,
+                        new_solutions,
+                        previous_values,
+                        self.start_time,
+                        self.time_limit)
                 
-            # Padding solutions
-            while len(solution_pool)<pool_size:
-                solution_pool.append(best_solution)
-                previous_values.append(temp_best_value)
-            if self.verbose:
-                print("Loops ran: {}, Accepted Operators: {}, Most used operators: {}, Most Recent operator: {}".format(self.hits['tried'],self.hits['successful'],max(set(self.hits['type']), key=self.hits['type'].count),self.hits['type'][-1]))
+                # Padding solutions
+                while len(solution_pool)<pool_size:
+                    solution_pool.append(best_solution)
+                    previous_values.append(temp_best_value)
+                if self.verbose:
+                    print("Loops ran: {}, Accepted Operators: {}, Most used operators: {}, Most Recent operator: {}".format(self.hits['tried'],self.hits['successful'],max(set(self.hits['type']), key=self.hits['type'].count),self.hits['type'][-1]))
 
         if self.verbose:
             summary = solution_summary(self.data, best_solution)
 
+        print("Evaluation cache (candidates): {} hits in {} lookups ({:.1%})".format(self.telemetry.cache_hits,
+                                                                                  self.telemetry.cache_lookups,
+                                                                                  self.telemetry.cache_hit_rate()))
+        if(self.heuristic_selection in ['qlearner', 'mcrl']):
+            print("Parent scores (learners): {} hits in {} lookups ({:.1%})".format(self.telemetry.parent_hits,
+                                                                                 self.telemetry.parent_lookups,
+                                                                                 self.telemetry.parent_hit_rate()))
+        print("Proposals rejected before evaluation: {}".format(self.telemetry.rejected_proposals()))
+
         # Records final solution value
         self.solution_collect_costs(best_solution)
                 
         return best_solution, self.costs
 
+    def asynchronous_hyper_heuristic(self, solution, pool_size = None, initial_pool = None):
+        """
+        Same search as improvement_hyper_heuristic without waiting for a whole generation of moves.
+        Every slot of the solution pool always has a move running in a worker. When a move finishes it is
+        accepted (or the slot falls back to the best solution) and a new move is started from the slot straight away,
+        so a slow move never holds up the other cores.
+        Record-to-record acceptance compares against the best solution found so far.
+        """
+
+        # Preallocating features
+        print(f"Starting asynchronous hyper-heuristic")
+        if(pool_size is None):
+            pool_size = self.pool_size
+        best_solution = solution
+        best_solution_value = self.solution_check(solution)["Cost"]
+        solution_pool, previous_values = self.starting_pool(solution, best_solution_value, pool_size, initial_pool)
+
+        # Applying heuristic
+        self.setStartTime(time.time())
+        t_end = time.time() + (self.time_limit - self.time_tolerance)
+        finished = queue.Queue()
+        shared_learning = self.share_learning_state()
+        with mp.Pool(self.cores, initializer = init_worker, initargs = (self, shared_learning)) as p:
+            def start_move(i):
+                p.apply_async(adjust_solution, ((solution_pool[i], rd.randint(1,100000), self.choose_operators(),
+                                                 self.parent_value(solution_pool[i])),),
+                              callback = lambda result: finished.put((i, result)),
+                              error_callback = lambda error: finished.put((i, error)))
+
+            for i in range(pool_size):
+                start_move(i)
+
+            while time.time() < t_end:
+                # Waiting for the next move to finish
+                try:
+                    i, result = finished.get(timeout = max(0, t_end - time.time()))
+                except queue.Empty:
+                    break
+                if(isinstance(result, Exception)):
+                    raise result
+                new_solution, value = result
+                if(value is None):
+                    value = self.solutions_score([new_solution])[0]
+                else:
+                    self.cache_scores([new_solution], [value])
+                self.moves_evaluated += 1
+                self.telemetry.record(new_solution, value, previous_values[i])
+                self.reward_operators(new_solution, value, previous_values[i])
+
+                # Append number of attempts
+                if self.verbose:
+                    self.hits['tried'] += 1
+
+                # Saving best solution (infeasible solutions are never kept)
+                if(value["Violations"] > 0 and value["Cost"] < best_solution_value):
+                    start_move(i)
+                    continue
+                if(value["Cost"] < best_solution_value):
+                    best_solution = new_solution
+                    best_solution_value = value["Cost"]
+                    self.solution_collect_costs(new_solution)
+
+                # Deciding whether to accept the new solution into its slot
+                if(self.acceptance_selection == "improve_only"):
+                    accepted, accepted_values = acceptance.improve_only()
+                elif(self.acceptance_selection == "r2r"):
+                    accepted, accepted_values = acceptance.bestrr([value], [new_solution], best_solution_value)
+                else:
+                    accepted, accepted_values = acceptance.simulated_annealing([value],
+                                                                               [new_solution],
+                                                                               [previous_values[i]],
+                                                                               self.start_time,
+                                                                               self.time_limit)
+                if(len(accepted) > 0):
+                    solution_pool[i] = accepted[0]
+                    previous_values[i] = accepted_values[0]
+                else:
+                    solution_pool[i] = best_solution
+                    previous_values[i] = best_solution_value
+                start_move(i)
+
+        if self.verbose:
+            summary = solution_summary(self.data, best_solution)
+
+        print("Evaluation cache (candidates): {} hits in {} lookups ({:.1%})".format(self.telemetry.cache_hits,
+                                                                                  self.telemetry.cache_lookups,
+                                                                                  self.telemetry.cache_hit_rate()))
+        if(self.heuristic_selection in ['qlearner', 'mcrl']):
+            print("Parent scores (learners): {} hits in {} lookups ({:.1%})".format(self.telemetry.parent_hits,
+                                                                                 self.telemetry.parent_lookups,
+                                                                                 self.telemetry.parent_hit_rate()))
+        print("Proposals rejected before evaluation: {}".format(self.telemetry.rejected_proposals()))
+
+        # Records final solution value
+        self.solution_collect_costs(best_solution)
+
+        return best_solution, self.costs
+
+    def starting_pool(self, solution, solution_value, pool_size, initial_pool = None):
+        """
+        Returns the first solution pool and its values: the solutions of initial_pool in turn, or copies of solution.
+        """
+        if(not initial_pool):
+            # Scored once more so the learners find the score of the pool's solutions in the evaluation cache
+            self.solution_score(solution)
+            return [solution for i in range(pool_size)], [solution_value for i in range(pool_size)]
+        values = [value["Cost"] for value in self.solutions_score(initial_pool)]
+        return ([initial_pool[i % len(initial_pool)] for i in range(pool_size)],
+                [values[i % len(initial_pool)] for i in range(pool_size)])
+
     def random_solution_adjustment(self,solution,seed):
         """
         Takes self and solution as input, applies an operator and returns new solution.
@@ -347,10 +729,10 @@ class Optimiser():
         rd.seed(seed)
         # Select an operator from the llh package to use
         operator_names = rd.choices(self.llh_names,k=rd.randint(1,self.max_sequence_length))
-        init_solution = solution
+        init_solution = sol.derive_solution(solution) # Copy-on-write, so the pool's solution is never changed
 
         for operator in operator_names:
-            new_solution = eval("llh."+operator+"(self.data,init_solution)")
+            new_solution = self.apply_move(operator, init_solution)
             init_solution = new_solution
         
         # Add the operator used
@@ -358,11 +740,76 @@ class Optimiser():
         # Return final solution
         return new_solution
     
-    def qlearner_solution_adjustment(self,solution):
+    def choose_operators(self):
+        """
+        Moves the main process picks for a candidate (adaptive pursuit), None if the worker picks them.
+        """
+        if(self.heuristic_selection != "pursuit"):
+            return None
+        return [self.llh_names[self.pursuit.selectAction(rd)] for i in range(rd.randint(1,self.max_sequence_length))]
+
+    def reward_operators(self, solution, value, parent_value):
+        """
+        Rewards the moves picked by adaptive pursuit with the cost improvement per second spent making and scoring the candidate.
+        Infeasible candidates and candidates that got worse are rewarded 0.
+        """
+        if(self.heuristic_selection != "pursuit"):
+            return
+        move_times = solution.get("move_times", [])
+        seconds = sum(t for name, t in move_times) + solution.get("evaluation_time", 0.0)
+        reward = 0.0
+        if(value["Violations"] == 0 and seconds > 0):
+            reward = max(0, parent_value - value["Cost"])/seconds
+        for name, t in move_times:
+            self.pursuit.update(self.llh_dict[name], reward)
+
+    def sequence_solution_adjustment(self, solution, operators):
+        """
+        Applies the given sequence of operators to a copy of solution and returns the new solution.
+        """
+        new_solution = sol.derive_solution(solution) # Copy-on-write, so the pool's solution is never changed
+        for operator in operators:
+            new_solution = self.apply_move(operator, new_solution)
+        new_solution['operator'] = str(operators)
+        return new_solution
+
+    def apply_move(self, name, solution):
+        """
+        Applies the low level heuristic name to solution and records its time in solution["move_times"]
+        and the proposals it turned down before evaluation in solution["rejections"].
+        """
+        t0 = time.perf_counter()
+        new_solution = llh.moves[name]["function"](self.data, solution)
+        new_solution.setdefault("move_times", []).append((name, time.perf_counter() - t0))
+        new_solution.setdefault("rejections", []).append((name, new_solution.pop("rejected", 0)))
+        if self.debug:
+            llh.__check_allocations__(self.data, new_solution)
+        return new_solution
+
+    def delta_check(self, evaluation, solution, start):
+        """
+        Brings evaluation up to date with the changes recorded in solution from index start and returns the same as
+        solution_check would for the python evaluator, only rescoring what the changes touched.
+        """
+        evaluation.apply_changes(solution["changes"][start:])
+        return evaluation.summary()
+
+    def best_operator(self, end = True):
+        """
+        Index of the low level heuristic with the highest Q-value in the current state of the Q-learner
+        (only the actions which are low level heuristics, "End" included if end).
+        """
+        actions = len(self.llh_names) if end else len(self.llh_names) - 1
+        return int(np.argmax(self.agent.getQTable()[self.agent.getCurrentState()][:actions]))
+
+    def qlearner_solution_adjustment(self,solution,evaluation = None):
         """
         Takes self and solution as input, applies an operator and returns new solution.
+        The rewards come from evaluation (of solution), which is kept up to date with the moves.
         """
         
+        # Copy-on-write, so the pool's solution is never changed (the moves record what they touch from here)
+        solution = sol.derive_solution(solution)
         new_solution = solution
         number_of_low_level_heuristics = len(self.llh_names)
         self.agent.setCurrentState((0, number_of_low_level_heuristics + 1))
@@ -381,8 +828,8 @@ class Optimiser():
             # Explore Randomly
             operator_number = self.llh_dict[rd.choices(self.llh_names[:-1])[0]]
         else:
-            # Exploit best action
-            operator_number = self.agent.getBestAction()
+            # Exploit best action (not ending the sequence straight away)
+            operator_number = self.best_operator(end = False)
         
         # Set a dummy new state to get into the while loop
         self.agent.setNewState((1,None))
@@ -394,12 +841,16 @@ class Optimiser():
         self.agent.setLearnRate(1/self.NVisits[self.agent.getCurrentState()+(operator_number,)])
 
         # Hold current score to evaluate reward later on
-        current_score = self.solution_score(solution)["Cost"]
+        if(evaluation is None):
+            evaluation = evl.Evaluation(self.data, solution)
+        current_score = evaluation.summary()
+        current_score = current_score["Cost"] + 1000*current_score["Violations"]
 
         # Applying the sequence
         while self.llh_names[operator_number] != "End" and self.agent.getNewState()[0] < self.max_sequence_length: 
             # Apply operator
-            new_solution = eval("llh."+self.llh_names[operator_number]+"(self.data,solution)")
+            start = len(solution["changes"])
+            new_solution = self.apply_move(self.llh_names[operator_number], solution)
 
             # Add the operator used to the new_solution
             new_solution["operator"] = self.llh_names[operator_number]
@@ -407,8 +858,9 @@ class Optimiser():
             #New state is now length of the sequence and last LLH chosen
             self.agent.setNewState((self.agent.getCurrentState()[0] + 1, operator_number))
 
-            #evaluate new solution score
-            new_score = self.solution_score(new_solution)["Cost"]
+            #evaluate new solution score (from the changes of the move)
+            new_score = self.delta_check(evaluation, new_solution, start)
+            new_score = new_score["Cost"] + 1000*new_score["Violations"]
             
             #evaluate reward = move in score for qlearner
             your_mums_reward = current_score - new_score#min(max(,0),1)
@@ -434,7 +886,7 @@ class Optimiser():
                 self.agent.setNewState((self.agent.getCurrentState()[0] + 1,operator_number))
             else:
                 #Exploit best action
-                operator_number = self.agent.getBestAction()
+                operator_number = self.best_operator()
                  #update new state with sequence length+1 and next used operator
                 self.agent.setNewState((self.agent.getCurrentState()[0] + 1,operator_number))
 
@@ -446,11 +898,14 @@ class Optimiser():
         # Return final solution
         return new_solution
 
-    def mcrl_solution_adjustment(self,solution):
+    def mcrl_solution_adjustment(self,solution,evaluation = None):
         """
         Takes self and solution as input, applies an operator and returns new solution.
+        The rewards come from evaluation (of solution), which is kept up to date with the moves.
         """
         
+        # Copy-on-write, so the pool's solution is never changed (the moves record what they touch from here)
+        solution = sol.derive_solution(solution)
         new_solution = solution
         number_of_low_level_heuristics = len(self.llh_names)
 
@@ -472,7 +927,7 @@ class Optimiser():
             operator_number = self.llh_dict[rd.choices(self.llh_names[:-1])[0]]
         else:
             # Exploit best action
-            operator_number = np.argmax(self.mc_table[0, number_of_low_level_heuristics + 1,:])
+            operator_number = int(np.argmax(self.mc_table[0, number_of_low_level_heuristics + 1,:number_of_low_level_heuristics - 1]))
         sequence_of_operators.append(operator_number)
 
         self.NVisits[0,sequence_of_operators[0],sequence_of_operators[1]] += 1
@@ -484,27 +939,33 @@ class Optimiser():
                 operator_number = self.llh_dict[rd.choices(self.llh_names)[0]]
             else:
                 # Exploit best action
-                operator_number = np.argmax(self.mc_table[len(sequence_of_operators),sequence_of_operators[-1],:])
+                operator_number = int(np.argmax(self.mc_table[len(sequence_of_operators),sequence_of_operators[-1],:number_of_low_level_heuristics]))
 
             sequence_of_operators.append(operator_number)
 
         # Hold current score to evaluate reward later on
-        current_score = self.solution_check(solution)["Cost"]
+        if(evaluation is None):
+            evaluation = evl.Evaluation(self.data, solution)
+        current_score = evaluation.summary()["Cost"]
         original_score = current_score
 
         # Applying the sequence
         for operator in range(1,len(sequence_of_operators)):
 
             operator_number=sequence_of_operators[operator]
+            if self.llh_names[operator_number] == "End":
+                sequence_of_operators = sequence_of_operators[:operator]
+                break
 
             # Apply operator
-            new_solution = eval("llh."+self.llh_names[operator_number]+"(self.data,solution)")
+            start = len(solution["changes"])
+            new_solution = self.apply_move(self.llh_names[operator_number], solution)
 
             # Add the operator used to the new_solution
             new_solution["operator"] = self.llh_names[operator_number]
 
-            #evaluate new solution score
-            new_score = self.solution_check(new_solution)["Cost"]
+            #evaluate new solution score (from the changes of the move)
+            new_score = self.delta_check(evaluation, new_solution, start)["Cost"]
             
             #evaluate reward = move in score for qlearner
             your_mums_reward = current_score - new_score#min(,1)max(,0)
@@ -0,0 +1,92 @@
+"""
+this module keeps ./bin/IHTP_Validator running as a pool of servers.
+
+Each server loads the instance once and then scores solutions streamed over a pipe (one JSON solution per line).
+Every answer is the usual validator report followed by a line "END".
+"""
+
+import json
+import os
+import subprocess
+
+VALIDATOR = './bin/IHTP_Validator'
+
+# Pools started by this process, keyed by instance file (worker processes start their own)
+pools = {}
+
+
+def get_pool(instance_file_name, size = 1):
+    """
+    Returns the validator pool of this process for an instance, starting one if required.
+    """
+    pool = pools.get(instance_file_name)
+    if(pool is None or pool.pid != os.getpid()):
+        pool = ValidatorPool(instance_file_name, size)
+        pools[instance_file_name] = pool
+    pool.size = max(pool.size, size)
+    return pool
+
+
+class ValidatorServer():
+    def __init__(self, instance_file_name):
+        self.process = subprocess.Popen(
+            [VALIDATOR, instance_file_name, '--server'],
+            stdin = subprocess.PIPE,
+            stdout = subprocess.PIPE,
+            text = True
+            )
+
+    def alive(self):
+        return self.process.poll() is None
+
+    def send(self, solution):
+        self.process.stdin.write(json.dumps(solution) + "\n")
+        self.process.stdin.flush()
+
+    def receive(self):
+        lines = []
+        for line in self.process.stdout:
+            if(line.strip() == "END"):
+                break
+            lines.append(line)
+        else:
+            raise RuntimeError("Validator server stopped unexpectedly")
+        return "".join(lines)
+
+    def close(self):
+        if(self.alive()):
+            self.process.stdin.close()
+            self.process.wait()
+
+
+class ValidatorPool():
+    def __init__(self, instance_file_name, size = 1):
+        self.instance_file_name = instance_file_name
+        self.size = size
+        self.pid = os.getpid()
+        self.servers = []
+
+    def check(self, solutions):
+        """
+        Returns the validator output of every solution.
+        Solutions are spread over the servers so they are scored concurrently, servers are started when first needed.
+        """
+        outputs = []
+        for i in range(0, len(solutions), self.size):
+            batch = solutions[i:i+self.size]
+            self.servers = [server for server in self.servers if server.alive()]
+            while(len(self.servers) < len(batch)):
+                self.servers.append(ValidatorServer(self.instance_file_name))
+            for server, solution in zip(self.servers, batch):
+                server.send(solution)
+            outputs += [server.receive() for server in self.servers[:len(batch)]]
+        # Reporting solutions the validator rejected once every server has answered
+        for output in outputs:
+            if(output.startswith("ERROR")):
+                raise ValueError(output.strip())
+        return outputs
+
+    def close(self):
+        for server in self.servers:
+            server.close()
+        self.servers = []
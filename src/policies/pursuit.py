@@ -0,0 +1,61 @@
+import random
+import numpy as np
+
+class AdaptivePursuit:
+
+    """
+    Adaptive pursuit selection of low level heuristics (Thierens, 2005)
+
+    Every action keeps an estimate of its reward, updated as an exponential moving average.
+    The selection probabilities are pushed towards p_max for the action with the best estimate
+    and towards p_min for every other action, so every action keeps being tried now and again.
+
+    Attributes
+    ----------
+    n_actions: int
+        number of actions (low level heuristics) to choose between
+
+    adaptation_rate: float
+        weight of a new reward in the reward estimate, takes value between [0,1]
+
+    learn_rate: float
+        rate at which the probabilities move towards their targets, takes value between [0,1]
+
+    p_min: float
+        smallest selection probability of an action
+    """
+
+    def __init__(self, n_actions: int, adaptation_rate: float = 0.1, learn_rate: float = 0.1, p_min: float = None):
+        self.n_actions = n_actions
+        self.adaptation_rate = adaptation_rate
+        self.learn_rate = learn_rate
+        self.p_min = p_min if p_min is not None else 0.2/n_actions
+        self.p_max = 1 - (n_actions - 1)*self.p_min
+        self.rewards = np.zeros(n_actions)
+        self.probabilities = np.full(n_actions, 1/n_actions)
+
+    def selectAction(self, rng = random) -> int:
+        """Returns an action drawn from the selection probabilities (rng is a random.Random or the random module)"""
+        cumulative = np.cumsum(self.probabilities)
+        return min(int(np.searchsorted(cumulative, rng.random()*cumulative[-1], side = "right")), self.n_actions - 1)
+
+    def update(self, action: int, reward: float):
+        """
+        Updates the reward estimate of action and pursues the action with the best estimate
+
+        Parameters
+        ----------
+            action: int
+                action that was taken
+
+            reward: float
+                reward observed for the action
+        """
+        self.rewards[action] += self.adaptation_rate*(reward - self.rewards[action])
+        # No action is ahead yet (e.g. no improvement found), keep the probabilities
+        if(self.rewards.max() == self.rewards.min()):
+            return
+        best = np.argmax(self.rewards)
+        targets = np.full(self.n_actions, self.p_min)
+        targets[best] = self.p_max
+        self.probabilities += self.learn_rate*(targets - self.probabilities)
@@ -0,0 +1,80 @@
+"""
+this module checks the python evaluator against ./bin/IHTP_Validator (used by bulk_main.py --parity and tests/test_parity.py).
+"""
+
+import json
+import random as rd
+import subprocess
+import tempfile
+
+import src.optimise.heuristics as llh
+import src.optimise.greedy as grd
+import src.optimise.evaluator as evl
+import src.optimise.validator as val
+import src.data.solution as sol
+from src.data.instance import Data
+
+
+def instance_parity(instance_file, moves = 200, seed = None):
+    """
+    A greedy solution of the instance is perturbed with random low level heuristics.
+    After every move the python evaluator and the validator must agree on every violation and cost.
+    The evaluation updated from the changes recorded by the moves must agree with a full evaluation,
+    the allocations updated by the moves must agree with a full rebuild,
+    and a validator server scoring every solution in turn must agree with a fresh validator run.
+    Returns the (move, components differing) of every solution with a difference.
+    """
+    with open(instance_file, 'r') as file:
+        data = Data(json.load(file))
+    rd.seed(seed if seed is not None else instance_file)
+    llh_names = llh.move_names()
+    solution = grd.greedy_allocation(data)
+    incremental = evl.Evaluation(data, solution)
+    server = val.ValidatorServer(instance_file)
+    mismatches = []
+    try:
+        for i in range(moves):
+            # Validator output per component
+            solution_json = sol.solution_to_json(data, solution)
+            with tempfile.NamedTemporaryFile() as solution_file:
+                solution_file.write(json.dumps(solution_json).encode())
+                solution_file.seek(0)
+                result = subprocess.run(
+                    [val.VALIDATOR, instance_file, solution_file.name],
+                    capture_output = True, # Python >= 3.7 only
+                    text = True # Python >= 3.7 only
+                    )
+            expected = validator_components(result.stdout)
+            # Validator server output (the server keeps its state between solutions)
+            server.send(solution_json)
+            served = validator_components(server.receive())
+            # Python output per component
+            evaluation = evl.Evaluation(data, solution)
+            found = dict(evaluation.totals)
+            found.update(evaluation.weighted_costs())
+            differences = ["Server" + name for name in expected if expected[name] != served.get(name)]
+            differences += [name for name in expected if expected[name] != found[name]]
+            differences += ["Incremental" + name for name in evaluation.totals if evaluation.totals[name] != incremental.totals[name]]
+            if(len(differences) > 0):
+                mismatches.append((i, differences))
+            # Perturbing the solution
+            solution["changes"] = []
+            solution = llh.moves[rd.choice(llh_names)]["function"](data, solution)
+            llh.__check_allocations__(data, solution)
+            incremental.apply_changes(solution["changes"])
+    finally:
+        server.close()
+    return mismatches
+
+
+def validator_components(output):
+    """
+    Violations and costs per component in a validator report.
+    """
+    components = {}
+    for line in output.splitlines():
+        if("." in line and len(line.split()) == 1):
+            components[line.split(".")[0]] = int(line.split(".")[-1])
+        elif('(' in line and '.' in line):
+            components[line.split('.')[0]] = int(line.split('.')[-1].split()[0])
+    return components
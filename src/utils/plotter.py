@@ -71,7 +71,7 @@ def solution_summary(data, solution):
     for r in data.data["rooms"]:
         out = r['id'] + ' (capacity ' + str(r['capacity']) + '): |'
         for d in data.all_days:
-            used = len(solution["room_allocation"][str((d,r["id"]))])
+            used = solution["room_allocation"][d,data.room_index[r["id"]]]
             avail = r['capacity']-used
             out = out + str(avail) + ','
         out = out + '|'
@@ -83,7 +83,7 @@ def solution_summary(data, solution):
     for s in data.data['surgeons']:
         out = s['id'] + ': |'
         for d in data.all_days:
-            out = out + str(solution['surgeon_allocation'][str((d,s['id']))]) + ','
+            out = out + str(solution['surgeon_allocation'][d,data.surgeon_index[s['id']]]) + ','
         out = out + '|'
         print(out)
         summary['surgeon_status'].append(out)
@@ -93,7 +93,7 @@ def solution_summary(data, solution):
     for t in data.data['operating_theaters']:
         out = t['id'] + ': |'
         for d in data.all_days:
-            out = out + str(solution['theater_allocation'][str((d,t['id']))]) + ','
+            out = out + str(solution['theater_allocation'][d,data.theater_index[t['id']]]) + ','
         out = out + '|'
         print(out)
         summary['theater_status'].append(out)
@@ -0,0 +1,48 @@
+"""
+this module contains helpers about the machine the optimiser runs on.
+"""
+
+import math
+import os
+
+def available_cores():
+    """
+    Returns the number of CPUs this process may use: the CPU affinity of the process,
+    limited by any cgroup CPU quota (e.g. docker --cpus or a slurm allocation).
+    """
+    if(hasattr(os, "sched_getaffinity")):
+        cores = len(os.sched_getaffinity(0))
+    else:
+        cores = os.cpu_count() or 1
+
+    quota = cgroup_cpu_quota()
+    if(quota is not None):
+        cores = min(cores, quota)
+    return max(1, cores)
+
+
+def cgroup_cpu_quota():
+    """
+    Returns the CPU quota of the cgroup rounded up to whole CPUs, None if there is no quota.
+    """
+    # cgroup v2: "<quota> <period>" or "max <period>"
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as file:
+            quota, period = file.read().split()
+        if(quota == "max"):
+            return None
+        return math.ceil(int(quota)/int(period))
+    except (OSError, ValueError):
+        pass
+
+    # cgroup v1: a quota of -1 means no limit
+    try:
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_quota_us") as file:
+            quota = int(file.read())
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_period_us") as file:
+            period = int(file.read())
+        if(quota <= 0 or period <= 0):
+            return None
+        return math.ceil(quota/period)
+    except (OSError, ValueError):
+        return None
@@ -0,0 +1,109 @@
+"""
+this module keeps statistics on the low level heuristics during a run of the hyper-heuristic.
+"""
+
+import json
+import time
+import pandas as pd
+
+class MoveTelemetry():
+    """
+    Per move: how often it is called, the time spent in the move and in evaluating its candidates,
+    and how the candidates it took part in compare with the solution they came from.
+    A candidate made by a sequence of moves counts for each move of the sequence.
+    The proposals a move turned down for breaking a hard constraint (never scored) are counted as rejected.
+    The hits of the evaluation cache are counted over all candidates, and apart for the scores of the parents
+    looked up for the learners (qlearner, mcrl), which score their candidates from the parent's score.
+    """
+    def __init__(self, names):
+        self.start_time = time.time()
+        self.stats = {name: {"calls": 0,
+                             "candidates": 0,
+                             "move_time": 0.0,
+                             "evaluation_time": 0.0,
+                             "improvements": 0,
+                             "feasible": 0,
+                             "total_delta": 0.0,
+                             "rejected": 0}
+                      for name in names}
+        self.cache_lookups = 0
+        self.cache_hits = 0
+        self.parent_lookups = 0
+        self.parent_hits = 0
+        # Attempts of the greedy construction of the starting solution (see greedy_allocation)
+        self.greedy_restarts = []
+
+    def record(self, solution, value, parent_value):
+        """
+        Records a scored candidate: solution["move_times"] holds the (move, seconds) applied to make it,
+        solution["rejections"] the (move, proposals turned down) and solution["evaluation_time"] the seconds taken to score it.
+        """
+        delta = value["Cost"] - parent_value
+        if("cache_hit" in solution):
+            self.cache_lookups += 1
+            self.cache_hits += solution["cache_hit"]
+        names = set()
+        for name, seconds in solution.get("move_times", []):
+            stats = self.stats[name]
+            stats["calls"] += 1
+            stats["move_time"] += seconds
+            names.add(name)
+        for name, rejected in solution.get("rejections", []):
+            self.stats[name]["rejected"] += rejected
+        for name in names:
+            stats = self.stats[name]
+            stats["candidates"] += 1
+            stats["evaluation_time"] += solution.get("evaluation_time", 0.0)/len(names)
+            stats["improvements"] += delta < 0
+            stats["feasible"] += value["Violations"] == 0
+            stats["total_delta"] += delta
+
+    def summary(self):
+        """
+        Returns one row per move with the totals and the derived rates.
+        """
+        rows = []
+        for name, stats in self.stats.items():
+            candidates = max(1, stats["candidates"])
+            total_time = stats["move_time"] + stats["evaluation_time"]
+            rows.append({"move": name,
+                         "calls": stats["calls"],
+                         "candidates": stats["candidates"],
+                         "rejected": stats["rejected"],
+                         "move_time": stats["move_time"],
+                         "evaluation_time": stats["evaluation_time"],
+                         "time_per_call": total_time/max(1, stats["calls"]),
+                         "improvement_rate": stats["improvements"]/candidates,
+                         "feasibility_rate": stats["feasible"]/candidates,
+                         "average_delta": stats["total_delta"]/candidates,
+                         "delta_per_second": stats["total_delta"]/total_time if total_time > 0 else 0.0})
+        return rows
+
+    def rejected_proposals(self):
+        return sum(stats["rejected"] for stats in self.stats.values())
+
+    def record_parent(self, hit):
+        self.parent_lookups += 1
+        self.parent_hits += hit
+
+    def cache_hit_rate(self):
+        return self.cache_hits/self.cache_lookups if self.cache_lookups > 0 else 0.0
+
+    def parent_hit_rate(self):
+        return self.parent_hits/self.parent_lookups if self.parent_lookups > 0 else 0.0
+
+    def export(self, file_name):
+        """
+        Writes the summary to file_name.csv and file_name.json.
+        """
+        rows = self.summary()
+        pd.DataFrame(rows).to_csv(file_name + ".csv", index = False)
+        with open(file_name + ".json", "w") as file:
+            json.dump({"run_time": time.time() - self.start_time,
+                       "cache_lookups": self.cache_lookups,
+                       "cache_hits": self.cache_hits,
+                       "parent_lookups": self.parent_lookups,
+                       "parent_hits": self.parent_hits,
+                       "rejected_proposals": self.rejected_proposals(),
+                       "greedy_restarts": self.greedy_restarts,
+                       "moves": rows}, file, indent = 2)
@@ -0,0 +1,25 @@
+"""
+Parity of the python evaluator with ./bin/IHTP_Validator on every instance of data/instances
+(skipped when the validator has not been built, see README.md).
+"""
+
+import os
+import pytest
+
+from src.utils.parity import instance_parity
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+data_folder = os.path.join(root, "data", "instances")
+instances = sorted(os.listdir(data_folder)) if os.path.isdir(data_folder) else []
+
+# Solutions checked per instance (bulk_main.py --parity checks more)
+parity_moves = 50
+
+
+@pytest.mark.skipif(not os.path.isfile(os.path.join(root, "bin", "IHTP_Validator")), reason = "bin/IHTP_Validator is not built")
+@pytest.mark.parametrize("instance", instances)
+def test_instance_parity(instance, monkeypatch):
+    # The validator is run from the repository root
+    monkeypatch.chdir(root)
+    mismatches = instance_parity(os.path.join(data_folder, instance), parity_moves, seed = instance)
+    assert mismatches == []